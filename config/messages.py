@@ -148,10 +148,60 @@ REGISTRATION_INVALID_ACTION = "Выберите одну из предложен
 
 # Предупреждения
 WARNING_PHOTO_SAVE = "⚠️ Ошибка при сохранении фото, но данные записаны."
+WARNING_THROTTLED = "⏳ Слишком много сообщений подряд. Подождите несколько секунд и повторите."
+WARNING_DUPLICATE_INN = (
+    "⚠️ Участник с таким ИНН уже зарегистрирован (№{total_number}, куратор {curator}).\n"
+    "Если это вы, повторно регистрироваться не нужно - нажмите /cancel. "
+    "Если ИНН введен с ошибкой, его можно исправить перед подтверждением."
+)
+WARNING_DUPLICATE_PHONE = (
+    "⚠️ Участник с таким телефоном уже зарегистрирован (№{total_number}, куратор {curator}).\n"
+    "Если это вы, повторно регистрироваться не нужно - нажмите /cancel. "
+    "Если номер введен с ошибкой, его можно исправить перед подтверждением."
+)
 
 # Команда /getfile
 GETFILE_SUCCESS = "📦 Архив всех данных регистрации"
 GETFILE_ERROR = "❌ Ошибка при создании архива"
+GETFILE_PROGRESS = "📦 Собираю архив: {done} из {total} файлов..."
+GETFILE_PROGRESS_VOLUMES = "📦 Собираю архив, часть {volume} из {volumes}: {done} из {total} файлов..."
+GETFILE_SENDING = "📤 Архив собран, отправляю..."
+GETFILE_VOLUME_CAPTION = "{caption}\n📎 Часть {volume} из {volumes}"
+GETFILE_DELTA_SUCCESS = "📦 Новые участники с прошлой выгрузки (выгрузка №{seq}, участников: {count})"
+GETFILE_SINCE_SUCCESS = "📦 Участники, зарегистрированные с {since} (участников: {count})"
+GETFILE_NOTHING_NEW = "ℹ️ Новых участников с прошлой выгрузки нет."
+GETFILE_NOTHING_SINCE = "ℹ️ С {since} новых участников нет."
+GETFILE_USAGE = (
+    "Использование:\n"
+    "/getfile - все данные\n"
+    "/getfile since - только новые с прошлой выгрузки\n"
+    "/getfile since=ДД.ММ.ГГГГ - зарегистрированные с указанной даты"
+)
+
+# Команда /slow
+SLOW_HEADER = "🐢 Самые долгие из последних регистраций ({count}):"
+SLOW_ITEM = (
+    "{status} {time} - {duration:.2f} с\n"
+    "user_id={user_id}, №{total_number}, куратор {curator}\n"
+    "{stages}"
+)
+SLOW_EMPTY = "ℹ️ С момента запуска бота регистраций еще не было."
+SLOW_USAGE = (
+    "Использование:\n/slow - десять самых долгих регистраций\n"
+    "/slow N - N самых долгих (не больше {max})"
+)
+
+# Команда /stats
+STATS_HEADER = "📊 <b>Участников всего: {total}</b>, сегодня: {today}"
+STATS_CURATORS = "\n<b>По кураторам:</b>"
+STATS_DAYS = "\n<b>За последние {days} дней:</b>"
+STATS_POSITIONS = "\n<b>По должностям:</b>"
+STATS_ITEM = "• {name}: {count}"
+STATS_NO_POSITION = "не указана"
+STATS_OTHER_POSITIONS = "• другие ({positions}): {count}"
+
+# Команды администратора
+NO_ACCESS = "⛔ Команда доступна только администратору."
 
 # Кнопки на клавиатуре
 BUTTON_SEND_CONTACT = "📱 Отправить контакт"
@@ -173,6 +223,11 @@ BUTTON_POSITION_PHARMACIST = "💊 Фармацевт"
 BUTTON_POSITION_MANUAL = "✍️ Ввести вручную"
 BUTTON_POSITION_MANUAL = "✍️ Ввести вручную"
 
+# Подписи к фото в альбомах
+PHOTO_CAPTION_PASSPORT_FRONT = "📸 <b>Лицевая сторона паспорта</b>"
+PHOTO_CAPTION_PASSPORT_BACK = "📸 <b>Обратная сторона паспорта</b>"
+PHOTO_CAPTION_DIPLOMA = "🎓 <b>Диплом</b>"
+
 # Сообщения в группы
 GROUP_MESSAGE_HEADER = "👤 <b>НОВАЯ РЕГИСТРАЦИЯ</b>\n\n"
 GROUP_MESSAGE_TOTAL_NUMBER = "📌 <b>Общий номер:</b> #{total_number}\n"
@@ -195,6 +250,10 @@ GENERAL_GROUP_MESSAGE = (
     "👨‍💼 <b>Куратор:</b> {curator}\n"
 )
 
+GROUP_DUPLICATE_HEADER = "\n⚠️ <b>Возможный дубль:</b>\n"
+GROUP_DUPLICATE_ITEM = "• {field}: как у #{total_number} {fio} (куратор {curator})\n"
+GROUP_DUPLICATE_FIELDS = {"inn": "ИНН", "phone": "Телефон"}
+
 CURATOR_GROUP_MESSAGE = (
     "👤 <b>НОВАЯ РЕГИСТРАЦИЯ</b>\n\n"
     "📌 <b>Ваш номер участника:</b> #{curator_number}\n\n"
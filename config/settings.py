@@ -25,3 +25,83 @@ ADMIN_ID = None  # Будет установлен позже
 DATA_PATH = "data"
 CONFIG_PATH = "config"
 COUNTERS_FILE = "config/counters.json"
+
+# Буферизованная запись Excel
+EXCEL_FLUSH_BATCH_SIZE = 20     # Сбрасывать на диск после стольких регистраций
+EXCEL_FLUSH_INTERVAL = 30       # ...или не реже чем раз в столько секунд
+
+# База регистраций (SQLite) - основной источник данных
+DB_FILE = "config/registrations.db"
+
+# Журнал счетчиков прежних версий (при запуске переносится в базу)
+COUNTERS_JOURNAL_FILE = "config/counters.journal"
+
+# Пул потоков для блокирующих операций с файлами
+STORAGE_MAX_WORKERS = 4
+STORAGE_MAX_QUEUE = 100         # Максимум операций, ожидающих свободного потока
+DB_MAX_WORKERS = 2              # Отдельные потоки для SQLite (FSM, база участников) - не ждут Excel и архивов
+
+# Скачивание фото
+PHOTO_DOWNLOAD_CONCURRENCY = 8      # Одновременных скачиваний на весь бот
+PHOTO_DOWNLOAD_RETRIES = 3          # Попыток на одно фото
+PHOTO_DOWNLOAD_BACKOFF = 1.0        # Начальная пауза между попытками, сек (удваивается)
+PHOTO_DOWNLOAD_TIMEOUT = 30         # Таймаут одного скачивания, сек
+PHOTO_DOWNLOAD_CHUNK_SIZE = 65536   # Размер куска при потоковой записи, байт
+
+# Промежуточная папка для фото, скачанных до подтверждения регистрации
+STAGING_PATH = "staging"
+
+# Ограничение частоты исходящих сообщений (лимиты Telegram)
+OUTBOUND_GLOBAL_RATE = 25           # Сообщений в секунду на весь бот
+OUTBOUND_GROUP_RATE = 20 / 60       # Сообщений в секунду в одну группу
+OUTBOUND_GROUP_BURST = 10           # Сколько сообщений в группу можно отправить разом
+OUTBOUND_PRIVATE_RATE = 1           # Сообщений в секунду в один личный чат
+OUTBOUND_MAX_RETRIES = 5            # Повторов после ответа 429 (retry_after)
+OUTBOUND_DRAIN_TIMEOUT = 30         # Сколько ждать отправки очереди при остановке, сек
+ALBUM_COPY_WAIT = 10                # Сколько группа куратора ждет альбом из общей группы, потом грузит свой, сек
+
+# Максимальный размер одной части архива /getfile (лимит Telegram на файл - 50 МБ)
+EXPORT_VOLUME_MAX_BYTES = 45 * 1024 * 1024
+
+# Последний полный архив /getfile (повторно отправляется, если новых регистраций не было)
+EXPORT_CACHE_PATH = "config/export_cache"
+
+# Состояния FSM (незавершенные регистрации) - переживают перезапуск бота
+FSM_DB_FILE = "config/fsm.db"
+FSM_CACHE_SIZE = 1000           # Сколько последних пользователей держать в памяти
+FSM_FLUSH_INTERVAL = 1.0        # Как часто сбрасывать изменения на диск, сек
+FSM_SESSION_TTL = 24 * 60 * 60  # Брошенная регистрация удаляется после стольких секунд без действий
+FSM_SWEEP_INTERVAL = 10 * 60    # Как часто искать брошенные регистрации, сек
+
+# Webhook (если WEBHOOK_URL не задан - бот работает через polling)
+WEBHOOK_URL = None              # Внешний адрес бота, например "https://bot.example.com"
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = None           # Секрет заголовка X-Telegram-Bot-Api-Secret-Token (None - случайный при запуске;
+                                # для нескольких экземпляров за балансировщиком задать явно)
+WEBHOOK_HOST = "0.0.0.0"        # Где слушать входящие запросы
+WEBHOOK_PORT = 8080
+WEBHOOK_MAX_CONCURRENT = 32     # Апдейтов, обрабатываемых одновременно
+WEBHOOK_MAX_PENDING = 1000      # Сверх этого отвечаем 503, и Telegram повторит доставку позже
+HEALTH_PATH = "/health"
+
+# Количество процессов бота. Больше 1 - только вместе с webhook: процессы
+# слушают один порт (SO_REUSEPORT, Linux), номера и состояния FSM берут из общей базы
+WORKERS = 1
+
+# Защита от потока сообщений одного пользователя
+THROTTLE_LIMIT = 5              # Не больше стольких сообщений...
+THROTTLE_WINDOW = 3.0           # ...за столько секунд (скользящее окно), остальные отбрасываются
+THROTTLE_MEDIA_GROUP_TTL = 30   # Сколько помнить альбом: из него обрабатывается только первое фото
+
+# Метрики Prometheus (http://METRICS_HOST:METRICS_PORT/metrics; у процесса N порт METRICS_PORT + N)
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Медленные регистрации
+SLOW_REGISTRATION_THRESHOLD = 10.0  # Регистрации дольше стольких секунд пишутся в лог по этапам
+SLOW_REGISTRATION_KEEP = 200        # Сколько последних регистраций помнить для команды /slow
+SLOW_COMMAND_MAX = 20               # Больше стольких регистраций /slow не показывает
+
+# Команда /stats
+STATS_TOP_POSITIONS = 10            # Должности (их вводят вручную) сверх этого числа - одной строкой "другие"
@@ -0,0 +1,235 @@
+"""
+Промежуточные обработчики (middleware) диспетчера
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import Message, TelegramObject
+
+from config.messages import WARNING_THROTTLED
+from config.settings import THROTTLE_LIMIT, THROTTLE_WINDOW, THROTTLE_MEDIA_GROUP_TTL
+from utils.metrics import HANDLER_LATENCY, HANDLER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в сообщениях) убирать из памяти неактивных пользователей и старые альбомы
+THROTTLE_CLEANUP_EVERY = 1000
+
+# Значение "еще не загружено из хранилища"
+_NOT_LOADED = object()
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSMContext, который читает состояние и данные из хранилища один раз
+    (при первом обращении) и дальше работает с локальной копией.
+    Изменения записываются в хранилище одним вызовом commit()
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey, raw_state: Any = _NOT_LOADED):
+        super().__init__(storage=storage, key=key)
+        # Состояние уже прочитано диспетчером для фильтров - берем его
+        self._state = raw_state
+        self._data: Any = _NOT_LOADED
+        self._state_changed = False
+        self._data_changed = False
+
+    async def _load_data(self) -> Dict[str, Any]:
+        """Локальная копия данных"""
+        if self._data is _NOT_LOADED:
+            self._data = await self.storage.get_data(key=self.key)
+        return self._data
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_changed = True
+
+    async def get_state(self) -> Optional[str]:
+        if self._state is _NOT_LOADED:
+            self._state = await self.storage.get_state(key=self.key)
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = data.copy()
+        self._data_changed = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        return (await self._load_data()).copy()
+
+    async def update_data(
+        self, data: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        current = await self._load_data()
+        current.update(kwargs)
+        self._data_changed = True
+        return current.copy()
+
+    async def clear(self) -> None:
+        await self.set_state(state=None)
+        await self.set_data({})
+
+    async def commit(self):
+        """Записывает изменения в хранилище"""
+        if self._data_changed:
+            await self.storage.set_data(key=self.key, data=self._data)
+            self._data_changed = False
+        if self._state_changed:
+            await self.storage.set_state(key=self.key, state=self._state)
+            self._state_changed = False
+
+
+class BufferedStateMiddleware(BaseMiddleware):
+    """
+    Подменяет FSMContext обработчика на BufferedFSMContext: сколько бы раз
+    обработчик ни вызывал get_data/update_data, хранилище читается один
+    раз и записывается один раз - после выхода из обработчика
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        state: Optional[FSMContext] = data.get("state")
+        if state is None:
+            return await handler(event, data)
+
+        buffered = BufferedFSMContext(
+            state.storage, state.key, data.get("raw_state", _NOT_LOADED)
+        )
+        data["state"] = buffered
+        try:
+            return await handler(event, data)
+        finally:
+            # Изменения, сделанные до ошибки, тоже сохраняются - как и без буфера
+            await buffered.commit()
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает поток сообщений от одного пользователя: не больше limit
+    сообщений за window секунд (скользящее окно). Лишние сообщения
+    отбрасываются до фильтров и обработчиков; о превышении пользователь
+    узнает один раз за окно.
+
+    Альбом (сообщения с одинаковым media_group_id) приходит отдельными
+    апдейтами на каждое фото - обрабатывается только первое из них, поэтому
+    на альбом вместо одного фото приходит одно сообщение об ошибке, а не по
+    одному на каждое фото.
+    """
+
+    def __init__(
+        self,
+        limit: int = THROTTLE_LIMIT,
+        window: float = THROTTLE_WINDOW,
+        media_group_ttl: float = THROTTLE_MEDIA_GROUP_TTL
+    ):
+        self.limit = limit
+        self.window = window
+        self.media_group_ttl = media_group_ttl
+        self._hits: Dict[int, Deque[float]] = {}
+        self._warned_at: Dict[int, float] = {}
+        self._media_groups: Dict[str, float] = {}
+        self._calls = 0
+        self.passed = 0
+        self.dropped_rate = 0
+        self.dropped_media_group = 0
+
+    def _cleanup(self, now: float):
+        """Убирает пользователей без сообщений в окне и забытые альбомы"""
+        for user_id in [u for u, hits in self._hits.items() if not hits or hits[-1] <= now - self.window]:
+            del self._hits[user_id]
+            self._warned_at.pop(user_id, None)
+        for group_id in [g for g, seen_at in self._media_groups.items() if seen_at <= now - self.media_group_ttl]:
+            del self._media_groups[group_id]
+
+    def _is_duplicate_media_group(self, message: Message, now: float) -> bool:
+        """Сообщение - не первое фото уже полученного альбома"""
+        if not message.media_group_id:
+            return False
+        seen_at = self._media_groups.get(message.media_group_id)
+        if seen_at is not None and seen_at > now - self.media_group_ttl:
+            return True
+        self._media_groups[message.media_group_id] = now
+        return False
+
+    def _is_over_limit(self, user_id: int, now: float) -> bool:
+        """Добавляет сообщение в окно пользователя, если есть место"""
+        hits = self._hits.setdefault(user_id, deque())
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if len(hits) >= self.limit:
+            return True
+        hits.append(now)
+        return False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % THROTTLE_CLEANUP_EVERY == 0:
+            self._cleanup(now)
+
+        if self._is_duplicate_media_group(event, now):
+            self.dropped_media_group += 1
+            return None
+
+        user_id = event.from_user.id
+        if self._is_over_limit(user_id, now):
+            self.dropped_rate += 1
+            warned_at = self._warned_at.get(user_id)
+            if warned_at is None or warned_at <= now - self.window:
+                self._warned_at[user_id] = now
+                logger.warning(f"Пользователь {user_id} превысил лимит сообщений, лишние отбрасываются")
+                await event.answer(WARNING_THROTTLED)
+            return None
+
+        self.passed += 1
+        return await handler(event, data)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики пропущенных и отброшенных сообщений"""
+        return {
+            "passed": self.passed,
+            "dropped_rate": self.dropped_rate,
+            "dropped_media_group": self.dropped_media_group,
+            "tracked_users": len(self._hits),
+        }
+
+
+throttling_middleware = ThrottlingMiddleware()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы и ошибки каждого обработчика (по имени функции)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with HANDLER_LATENCY.time(handler=name):
+            try:
+                return await handler(event, data)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
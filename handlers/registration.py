@@ -1,30 +1,52 @@
 """
 Обработчики для сохранения файлов и отправки сообщений
 """
+import asyncio
+import html
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 from aiogram import Bot
-from aiogram.types import Message
+from aiogram.types import InputMediaPhoto, Message
 
-from config.settings import GROUPS, DATA_PATH
+from config.settings import GROUPS, ALBUM_COPY_WAIT
 from config.messages import (
     GENERAL_GROUP_MESSAGE, 
     CURATOR_GROUP_MESSAGE,
+    GROUP_DUPLICATE_HEADER,
+    GROUP_DUPLICATE_ITEM,
+    GROUP_DUPLICATE_FIELDS,
     REGISTRATION_SUCCESS,
     REGISTRATION_ERROR,
-    WARNING_PHOTO_SAVE
+    WARNING_PHOTO_SAVE,
+    PHOTO_CAPTION_PASSPORT_FRONT,
+    PHOTO_CAPTION_PASSPORT_BACK,
+    PHOTO_CAPTION_DIPLOMA
 )
 from utils.file_manager import (
     create_user_folder, 
-    save_user_info, 
-    increment_counters
+    save_user_info
 )
-from utils.excel_manager import create_or_update_curator_excel, create_or_update_general_excel
+from utils.executor import storage_executor, db_executor
+from utils.photo_downloader import PHOTO_FILES, download_photo
+from utils.prefetch import photo_prefetcher
+from utils.outbound import outbound_scheduler
+from utils.excel_writer import excel_writer
+from utils.storage import store
+from utils.tracing import registration_tracer
+from utils.stats import stats_service
+from utils.duplicates import Registration, duplicate_index, find_duplicates
 
 logger = logging.getLogger(__name__)
 
+# Поле с file_id в данных FSM -> подпись к фото в альбоме
+PHOTO_CAPTIONS = {
+    'passport_front_file_id': PHOTO_CAPTION_PASSPORT_FRONT,
+    'passport_back_file_id': PHOTO_CAPTION_PASSPORT_BACK,
+    'diploma_file_id': PHOTO_CAPTION_DIPLOMA,
+}
+
 
 async def save_photos(
     bot: Bot,
@@ -32,144 +54,160 @@ async def save_photos(
     user_path: Path
 ) -> bool:
     """
-    Скачивает и сохраняет фото
+    Сохраняет фото: берет уже скачанные заранее из промежуточной папки,
+    остальные скачивает (все параллельно).
+    Уже скачанные фото остаются на месте, даже если другие не скачались
     """
-    try:
-        # Скачивание фото лицевой стороны паспорта
-        passport_front_file = await bot.get_file(user_data.get('passport_front_file_id'))
-        passport_front_path = user_path / "passport_front.jpg"
-        await bot.download_file(passport_front_file.file_path, passport_front_path)
-        logger.info(f"Фото паспорта (лицевая) сохранено: {passport_front_path}")
-        
-        # Скачивание фото обратной стороны паспорта
-        passport_back_file = await bot.get_file(user_data.get('passport_back_file_id'))
-        passport_back_path = user_path / "passport_back.jpg"
-        await bot.download_file(passport_back_file.file_path, passport_back_path)
-        logger.info(f"Фото паспорта (обратная) сохранено: {passport_back_path}")
-        
-        # Скачивание фото диплома
-        diploma_file = await bot.get_file(user_data.get('diploma_file_id'))
-        diploma_path = user_path / "diploma.jpg"
-        await bot.download_file(diploma_file.file_path, diploma_path)
-        logger.info(f"Фото диплома сохранено: {diploma_path}")
-        
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении фото: {e}")
-        return False
+    user_id = user_data.get('user_id')
+    
+    async def save_photo(field: str, destination: Path) -> Path:
+        file_id = user_data.get(field)
+        if user_id and await photo_prefetcher.collect(user_id, field, file_id, destination):
+            return destination
+        return await download_photo(bot, file_id, destination)
+    
+    downloads = {
+        filename: save_photo(field, user_path / filename)
+        for field, filename in PHOTO_FILES.items()
+        if user_data.get(field)
+    }
+    results = await asyncio.gather(*downloads.values(), return_exceptions=True)
+    
+    all_saved = len(downloads) == len(PHOTO_FILES)
+    for filename, result in zip(downloads, results):
+        if isinstance(result, BaseException):
+            all_saved = False
+            logger.error(f"Ошибка при сохранении фото {filename}: {result}")
+        else:
+            logger.info(f"Фото сохранено: {result}")
+    
+    return all_saved
+
+
+def build_photo_album(user_data: Dict[str, Any]) -> List[InputMediaPhoto]:
+    """Собирает альбом из фото участника"""
+    return [
+        InputMediaPhoto(media=user_data[field], caption=caption, parse_mode="HTML")
+        for field, caption in PHOTO_CAPTIONS.items()
+        if user_data.get(field)
+    ]
+
+
+def build_duplicate_note(duplicates: List[Tuple[str, Registration]]) -> str:
+    """Пометка для групп: с кем совпадают ИНН или телефон"""
+    if not duplicates:
+        return ""
+    # Один и тот же участник может совпасть и по ИНН, и по телефону
+    fields: Dict[Registration, List[str]] = {}
+    for field, registration in duplicates:
+        fields.setdefault(registration, []).append(GROUP_DUPLICATE_FIELDS[field])
+    return GROUP_DUPLICATE_HEADER + "".join(
+        GROUP_DUPLICATE_ITEM.format(
+            field=" и ".join(names),
+            total_number=registration.total_number,
+            fio=html.escape(registration.fio or ""),
+            curator=html.escape(registration.curator or "")
+        )
+        for registration, names in fields.items()
+    )
 
 
 async def send_to_groups(
     bot: Bot,
     user_data: Dict[str, Any],
     total_number: int,
-    curator_number: int
+    curator_number: int,
+    duplicates: Optional[List[Tuple[str, Registration]]] = None
 ) -> bool:
     """
-    Отправляет сообщения в группы с фото альбомом
+    Отправляет сообщения в группы с фото альбомом.
+    Альбом загружается один раз - в общую группу, а в группу куратора
+    копируется оттуда через copy_messages. Если общая группа за
+    ALBUM_COPY_WAIT секунд альбом не получила (ее лимит Telegram
+    исчерпан), куратору альбом загружается отдельно - его очередь не
+    стоит за очередью общей группы. Сообщения ставятся в очередь
+    outbound_scheduler и уходят с учетом лимитов Telegram, не задерживая
+    ответ пользователю. Совпадения ИНН или телефона (duplicates)
+    отмечаются в обоих сообщениях
     """
-    from aiogram.types import InputMediaPhoto
-    
     try:
         curator = user_data.get('curator')
+        general_group_id = GROUPS['general']
         
-        # Сообщение в общую группу
-        general_msg = GENERAL_GROUP_MESSAGE.format(
-            total_number=total_number,
-            curator_number=curator_number,
-            fio=user_data.get('fio'),
-            pharmacy_name=user_data.get('pharmacy_name', ''),
-            pharmacy_number=user_data.get('pharmacy_number', ''),
-            position=user_data.get('position', ''),
-            inn=user_data.get('inn'),
-            phone=user_data.get('phone'),
-            curator=curator
-        )
-        
-        await bot.send_message(
-            GROUPS['general'],
-            general_msg,
-            parse_mode="HTML"
-        )
-        logger.info(f"Сообщение отправлено в общую группу")
+        # Поля карточки общие для обеих групп
+        card_fields = {
+            'total_number': total_number,
+            'curator_number': curator_number,
+            'fio': user_data.get('fio'),
+            'pharmacy_name': user_data.get('pharmacy_name', ''),
+            'pharmacy_number': user_data.get('pharmacy_number', ''),
+            'position': user_data.get('position', ''),
+            'inn': user_data.get('inn'),
+            'phone': user_data.get('phone'),
+            'curator': curator,
+        }
         
-        # Собираем фото для альбома
-        media_group = []
+        duplicate_note = build_duplicate_note(duplicates)
         
-        try:
-            passport_front = user_data.get('passport_front_file_id')
-            if passport_front:
-                media_group.append(
-                    InputMediaPhoto(
-                        media=passport_front,
-                        caption="📸 <b>Лицевая сторона паспорта</b>",
-                        parse_mode="HTML"
-                    )
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при подготовке фото паспорта (лицевая): {e}")
-        
-        try:
-            passport_back = user_data.get('passport_back_file_id')
-            if passport_back:
-                media_group.append(
-                    InputMediaPhoto(
-                        media=passport_back,
-                        caption="📸 <b>Обратная сторона паспорта</b>",
-                        parse_mode="HTML"
-                    )
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при подготовке фото паспорта (обратная): {e}")
-        
-        try:
-            diploma = user_data.get('diploma_file_id')
-            if diploma:
-                media_group.append(
-                    InputMediaPhoto(
-                        media=diploma,
-                        caption="🎓 <b>Диплом</b>",
-                        parse_mode="HTML"
-                    )
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при подготовке фото диплома: {e}")
+        # Сообщение в общую группу
+        general_msg = GENERAL_GROUP_MESSAGE.format(**card_fields) + duplicate_note
+        outbound_scheduler.submit(
+            general_group_id,
+            lambda: bot.send_message(general_group_id, general_msg, parse_mode="HTML"),
+            label=f"регистрация №{total_number}: сообщение в общую группу"
+        )
+        logger.info(f"Сообщение поставлено в очередь общей группы")
         
         # Отправляем альбом в общую группу
+        media_group = build_photo_album(user_data)
+        album_sent = None
         if media_group:
-            try:
-                await bot.send_media_group(GROUPS['general'], media=media_group)
-                logger.info("Альбом фото отправлен в общую группу")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке альбома в общую группу: {e}")
-        
-        # Сообщение в группу куратора
-        curator_msg = CURATOR_GROUP_MESSAGE.format(
-            curator_number=curator_number,
-            fio=user_data.get('fio'),
-            pharmacy_name=user_data.get('pharmacy_name', ''),
-            pharmacy_number=user_data.get('pharmacy_number', ''),
-            position=user_data.get('position', ''),
-            inn=user_data.get('inn'),
-            phone=user_data.get('phone')
-        )
+            album_sent = outbound_scheduler.submit(
+                general_group_id,
+                lambda: bot.send_media_group(general_group_id, media=media_group),
+                cost=len(media_group),
+                label=f"регистрация №{total_number}: фото в общую группу"
+            )
+            logger.info("Альбом фото поставлен в очередь общей группы")
         
         curator_group_id = GROUPS.get(curator)
         if curator_group_id:
-            await bot.send_message(
+            # Сообщение в группу куратора (текст отличается, поэтому не копия)
+            curator_msg = CURATOR_GROUP_MESSAGE.format(**card_fields) + duplicate_note
+            outbound_scheduler.submit(
                 curator_group_id,
-                curator_msg,
-                parse_mode="HTML"
+                lambda: bot.send_message(curator_group_id, curator_msg, parse_mode="HTML"),
+                label=f"регистрация №{total_number}: сообщение в группу {curator}"
             )
-            logger.info(f"Сообщение отправлено в группу {curator}")
+            logger.info(f"Сообщение поставлено в очередь группы {curator}")
             
-            # Отправляем альбом в группу куратора
-            if media_group:
-                try:
-                    await bot.send_media_group(curator_group_id, media=media_group)
-                    logger.info("Альбом фото отправлен в группу куратора")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке альбома в группу куратора: {e}")
+            # Копируем альбом из общей группы в группу куратора
+            if album_sent is not None:
+                async def copy_album():
+                    try:
+                        sent_messages = await asyncio.wait_for(
+                            asyncio.shield(album_sent), ALBUM_COPY_WAIT
+                        )
+                    except asyncio.TimeoutError:
+                        logger.info(
+                            f"Альбом №{total_number} ждет отправки в общую группу "
+                            f"дольше {ALBUM_COPY_WAIT} сек - загружаем его в группу {curator}"
+                        )
+                        return await bot.send_media_group(curator_group_id, media=media_group)
+                    except Exception:
+                        # Альбом в общую группу не ушел - загружаем его заново
+                        return await bot.send_media_group(curator_group_id, media=media_group)
+                    return await bot.copy_messages(
+                        curator_group_id,
+                        general_group_id,
+                        [sent.message_id for sent in sent_messages]
+                    )
+                
+                outbound_scheduler.submit(
+                    curator_group_id, copy_album, cost=len(media_group),
+                    label=f"регистрация №{total_number}: фото в группу {curator}"
+                )
+                logger.info("Копия альбома поставлена в очередь группы куратора")
         
         return True
     except Exception as e:
@@ -186,80 +224,99 @@ async def finalize_registration(
     Завершает регистрацию:
     1. Создает папку пользователя
     2. Сохраняет фото
-    3. Сохраняет инфо
-    4. Обновляет Excel куратора
+    3. Записывает участника в базу и получает его номера (Excel строится из базы в фоне)
+    4. Сохраняет инфо
     5. Отправляет сообщения в группы
     """
+    curator = user_data.get('curator')
+    fio = user_data.get('fio')
+    trace = registration_tracer.start(user_data.get('user_id'), curator)
+    success = False
     try:
-        curator = user_data.get('curator')
-        fio = user_data.get('fio')
-        
         # Создание папки
-        user_path = create_user_folder(curator, fio)
-        logger.info(f"Создана папка пользователя: {user_path}")
-        
-        # Увеличение счетчиков
-        total_number, curator_number = increment_counters(curator)
-        logger.info(f"Счетчики обновлены: Общий={total_number}, Куратор={curator_number}")
+        with trace.span("folder"):
+            user_path = await storage_executor.run(None, create_user_folder, curator, fio)
+        logger.info(f"Регистрация {trace.label}: создана папка {user_path}")
         
         # Сохранение фото
-        photos_saved = await save_photos(bot, user_data, user_path)
+        with trace.span("photos"):
+            photos_saved = await save_photos(bot, user_data, user_path)
         if not photos_saved:
+            logger.error(f"Регистрация {trace.label}: не удалось сохранить фото")
             await message.answer(WARNING_PHOTO_SAVE)
             return False
         
-        # Сохранение информации
-        save_user_info(user_path, user_data, total_number, curator_number)
-        logger.info("Информация пользователя сохранена")
+        # Совпадения ищем до записи, иначе участник найдет сам себя
+        with trace.span("duplicates"):
+            duplicates = await find_duplicates(user_data.get('inn'), user_data.get('phone'))
+        if duplicates:
+            logger.warning(
+                f"Регистрация {trace.label}: возможный дубль участников "
+                f"{', '.join(f'#{r.total_number} ({field})' for field, r in duplicates)}"
+            )
         
-        # Обновление Excel
-        excel_ok = create_or_update_curator_excel(
-            curator=curator,
-            fio=fio,
-            inn=user_data.get('inn'),
-            phone=user_data.get('phone'),
-            curator_number=curator_number,
-            total_number=total_number,
-            user_folder_path=str(user_path),
-            pharmacy_name=user_data.get('pharmacy_name', ''),
-            pharmacy_number=user_data.get('pharmacy_number', ''),
-            position=user_data.get('position', '')
+        # Номера выдаются в одной транзакции с записью участника:
+        # неудачная регистрация номер не занимает
+        with trace.span("database"):
+            participant_id, total_number, curator_number = await db_executor.run(
+                store.db_path, store.register_participant, {
+                    'curator': curator,
+                    'fio': fio,
+                    'pharmacy_name': user_data.get('pharmacy_name', ''),
+                    'pharmacy_number': user_data.get('pharmacy_number', ''),
+                    'position': user_data.get('position', ''),
+                    'inn': user_data.get('inn'),
+                    'phone': user_data.get('phone'),
+                    'user_id': user_data.get('user_id'),
+                    'username': user_data.get('username'),
+                    'folder': str(user_path),
+                }
+            )
+        trace.total_number = total_number
+        stats_service.record(participant_id, curator, user_data.get('position', ''))
+        duplicate_index.add(participant_id, {
+            'total_number': total_number,
+            'curator': curator,
+            'fio': fio,
+            'inn': user_data.get('inn'),
+            'phone': user_data.get('phone'),
+        })
+        logger.info(
+            f"Регистрация {trace.label}: участник записан в базу, "
+            f"id={participant_id}, Куратор={curator_number}"
         )
-        if excel_ok:
-            logger.info(f"Excel файл куратора {curator} обновлен")
-        else:
-            logger.warning(f"Ошибка при обновлении Excel для куратора {curator}")
         
-        # Обновление общего Excel
-        general_excel_ok = create_or_update_general_excel(
-            fio=fio,
-            inn=user_data.get('inn'),
-            phone=user_data.get('phone'),
-            curator=curator,
-            total_number=total_number,
-            curator_number=curator_number,
-            pharmacy_name=user_data.get('pharmacy_name', ''),
-            pharmacy_number=user_data.get('pharmacy_number', ''),
-            position=user_data.get('position', '')
-        )
-        if general_excel_ok:
-            logger.info("Общий Excel файл обновлен")
-        else:
-            logger.warning("Ошибка при обновлении общего Excel файла")
+        # Сохранение информации
+        with trace.span("info"):
+            await storage_executor.run(
+                str(user_path), save_user_info, user_path, user_data, total_number, curator_number
+            )
+        
+        # Excel файлы строятся из базы в фоне (время записи - в метрике bot_excel_export_seconds)
+        excel_writer.notify()
         
         # Отправка в группы
-        groups_ok = await send_to_groups(bot, user_data, total_number, curator_number)
+        with trace.span("groups"):
+            groups_ok = await send_to_groups(bot, user_data, total_number, curator_number, duplicates)
         
-        await message.answer(
-            REGISTRATION_SUCCESS.format(
-                total_number=total_number,
-                curator_number=curator_number
-            ),
-            parse_mode="HTML"
-        )
+        # Промежуточные файлы больше не нужны
+        if user_data.get('user_id'):
+            photo_prefetcher.discard(user_data['user_id'])
+        
+        with trace.span("reply"):
+            await message.answer(
+                REGISTRATION_SUCCESS.format(
+                    total_number=total_number,
+                    curator_number=curator_number
+                ),
+                parse_mode="HTML"
+            )
         
+        success = True
         return True
     except Exception as e:
-        logger.error(f"Ошибка при завершении регистрации: {e}")
+        logger.error(f"Ошибка при завершении регистрации {trace.label}: {e}")
         await message.answer(REGISTRATION_ERROR)
         return False
+    finally:
+        registration_tracer.finish(trace, success)
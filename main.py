@@ -3,19 +3,59 @@
 """
 import logging
 import asyncio
+import html
+import inspect
+import multiprocessing
+import secrets
 import shutil
+import signal
 import tempfile
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, List, Optional
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, FSInputFile
+from aiogram.filters import Command, CommandObject
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, FSInputFile, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from config.settings import BOT_TOKEN, CURATORS, GROUPS, DATA_PATH, ADMIN_ID
+from config.settings import (
+    BOT_TOKEN, CURATORS, ADMIN_ID,
+    WEBHOOK_URL, WEBHOOK_SECRET, WORKERS, METRICS_ENABLED, METRICS_PORT, SLOW_COMMAND_MAX
+)
 from config.messages import *
-from handlers.registration import finalize_registration
+from handlers.registration import finalize_registration, build_photo_album, PHOTO_CAPTIONS
+from handlers.middlewares import BufferedStateMiddleware, HandlerMetricsMiddleware, throttling_middleware
 from utils.file_manager import ensure_directories_exist
+from utils.excel_writer import excel_writer
+from utils.storage import store
+from utils.counters import counter_service
+from utils.executor import storage_executor, db_executor
+from utils.prefetch import photo_prefetcher
+from utils.outbound import outbound_scheduler
+from utils.fsm_storage import fsm_storage
+from utils.session_sweeper import session_sweeper
+from utils.tracing import registration_tracer
+from utils.stats import stats_service
+from utils.duplicates import duplicate_index, find_duplicates
+from utils.webhook import run_webhook
+from utils.metrics import (
+    ApiMetricsMiddleware, FSM_SESSIONS, THROTTLED_UPDATES, registry, start_metrics_server
+)
+from utils.exporter import (
+    ExportProgress,
+    build_archive,
+    load_export_cache,
+    prepare_export_cache_dir,
+    save_export_cache,
+    build_volume_index,
+    collect_data_entries,
+    plan_volumes,
+    prepare_full_export,
+    prepare_delta_export,
+    prepare_since_export,
+    commit_export
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -23,7 +63,15 @@ logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+# Счетчики и время запросов к Bot API
+bot.session.middleware(ApiMetricsMiddleware())
+dp = Dispatcher(storage=fsm_storage)
+# Поток сообщений от одного пользователя отсекается до фильтров и обработчиков
+dp.message.outer_middleware(throttling_middleware)
+# Время работы обработчиков (вместе с записью состояния FSM)
+dp.message.middleware(HandlerMetricsMiddleware())
+# Состояние FSM читается и записывается один раз на апдейт
+dp.message.middleware(BufferedStateMiddleware())
 
 # Состояния для FSM (Finite State Machine)
 class RegistrationStates(StatesGroup):
@@ -61,8 +109,12 @@ async def cmd_start(message: types.Message, state: FSMContext):
     
     logger.info(f"Пользователь {user_id} (@{username}) начал регистрацию")
     
-    # Сохраняем ID пользователя
-    await state.update_data(user_id=user_id, username=username)
+    # Начинаем заново: прежние заранее скачанные фото больше не нужны
+    photo_prefetcher.discard(user_id)
+    
+    # Сохраняем ID пользователя. Экран просмотра прежней попытки уже
+    # далеко в чате - при следующем показе он отправится заново
+    await state.update_data(user_id=user_id, username=username, review=None)
     
     welcome_text = START_WELCOME.format(username=username)
     
@@ -73,6 +125,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
 async def cmd_cancel(message: types.Message, state: FSMContext):
     """Обработка команды /cancel для отмены регистрации"""
     await state.clear()
+    photo_prefetcher.discard(message.from_user.id)
     await message.answer("Регистрация отменена. Вы можете начать заново с команды /start.")
 
 # Обработчик выбора куратора
@@ -88,11 +141,10 @@ async def process_curator_choice(message: types.Message, state: FSMContext):
         )
         return
     
-    await state.update_data(curator=curator)
+    data = await state.update_data(curator=curator)
     logger.info(f"Пользователь выбрал куратора: {curator}")
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -111,11 +163,10 @@ async def process_fio(message: types.Message, state: FSMContext):
         await message.answer(FIO_INVALID)
         return
     
-    await state.update_data(fio=fio)
+    data = await state.update_data(fio=fio)
     logger.info(f"ФИО сохранено: {fio}")
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -135,11 +186,10 @@ async def process_pharmacy_name(message: types.Message, state: FSMContext):
         await message.answer(PHARMACY_NAME_INVALID)
         return
     
-    await state.update_data(pharmacy_name=pharmacy_name)
+    data = await state.update_data(pharmacy_name=pharmacy_name)
     logger.info(f"Название аптеки сохранено: {pharmacy_name}")
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -159,11 +209,10 @@ async def process_pharmacy_number(message: types.Message, state: FSMContext):
         await message.answer(PHARMACY_NUMBER_INVALID)
         return
     
-    await state.update_data(pharmacy_number=pharmacy_number)
+    data = await state.update_data(pharmacy_number=pharmacy_number)
     logger.info(f"Номер аптеки сохранен: {pharmacy_number}")
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -218,11 +267,10 @@ async def process_position(message: types.Message, state: FSMContext):
             await message.answer(POSITION_INVALID)
             return
     
-    await state.update_data(position=position)
+    data = await state.update_data(position=position)
     logger.info(f"Должность сохранена: {position}")
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -236,6 +284,22 @@ async def process_position(message: types.Message, state: FSMContext):
         await state.set_state(RegistrationStates.entering_inn)
 
 
+async def warn_if_duplicate(message: types.Message, inn: Optional[str] = None, phone: Optional[str] = None):
+    """Предупреждает, если такой ИНН или телефон уже есть у зарегистрированного участника"""
+    duplicates = await find_duplicates(inn=inn, phone=phone)
+    if not duplicates:
+        return
+    
+    field, registration = duplicates[0]
+    logger.warning(
+        f"Пользователь {message.from_user.id}: {field} совпадает с участником #{registration.total_number}"
+    )
+    warning = WARNING_DUPLICATE_INN if field == "inn" else WARNING_DUPLICATE_PHONE
+    await message.answer(
+        warning.format(total_number=registration.total_number, curator=registration.curator)
+    )
+
+
 # Обработчик ввода ИНН
 @dp.message(RegistrationStates.entering_inn)
 async def process_inn(message: types.Message, state: FSMContext):
@@ -247,11 +311,12 @@ async def process_inn(message: types.Message, state: FSMContext):
         await message.answer(INN_INVALID)
         return
     
-    await state.update_data(inn=inn)
+    data = await state.update_data(inn=inn)
     logger.info(f"ИНН сохранен: {inn}")
+    # Повторная регистрация не запрещена - только предупреждаем
+    await warn_if_duplicate(message, inn=inn)
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -281,11 +346,11 @@ async def process_phone_contact(message: types.Message, state: FSMContext):
     if not phone.startswith("+"):
         phone = "+" + phone
     
-    await state.update_data(phone=phone)
+    data = await state.update_data(phone=phone)
     logger.info(f"Телефон получен через контакт: {phone}")
+    await warn_if_duplicate(message, phone=phone)
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -322,11 +387,11 @@ async def process_phone_manual(message: types.Message, state: FSMContext):
         )
         return
     
-    await state.update_data(phone=phone)
+    data = await state.update_data(phone=phone)
     logger.info(f"Телефон получен вручную: {phone}")
+    await warn_if_duplicate(message, phone=phone)
     
     # Проверяем, редактируем ли мы данные
-    data = await state.get_data()
     if data.get('passport_front_file_id'):  # Если уже были загружены фото
         await show_review_screen(message, state)
     else:
@@ -358,10 +423,12 @@ async def process_passport_front(message: types.Message, state: FSMContext):
     
     photo = message.photo[-1]  # Берем самое качественное фото
     
-    await state.update_data(passport_front_file_id=photo.file_id)
+    data = await state.update_data(passport_front_file_id=photo.file_id)
     logger.info(f"Фото лицевой стороны паспорта получено: {photo.file_id}")
     
-    data = await state.get_data()
+    # Начинаем скачивание сразу, не дожидаясь подтверждения
+    photo_prefetcher.start(bot, message.from_user.id, 'passport_front_file_id', photo.file_id)
+    
     is_editing = data.get('editing_mode', False)
     
     if is_editing:
@@ -418,10 +485,12 @@ async def process_passport_back(message: types.Message, state: FSMContext):
     
     photo = message.photo[-1]
     
-    await state.update_data(passport_back_file_id=photo.file_id)
+    data = await state.update_data(passport_back_file_id=photo.file_id)
     logger.info(f"Фото обратной стороны паспорта получено: {photo.file_id}")
     
-    data = await state.get_data()
+    # Начинаем скачивание сразу, не дожидаясь подтверждения
+    photo_prefetcher.start(bot, message.from_user.id, 'passport_back_file_id', photo.file_id)
+    
     is_editing = data.get('editing_mode', False)
     
     if is_editing:
@@ -475,10 +544,12 @@ async def process_diploma(message: types.Message, state: FSMContext):
     
     photo = message.photo[-1]
     
-    await state.update_data(diploma_file_id=photo.file_id)
+    data = await state.update_data(diploma_file_id=photo.file_id)
     logger.info(f"Фото диплома получено: {photo.file_id}")
     
-    data = await state.get_data()
+    # Начинаем скачивание сразу, не дожидаясь подтверждения
+    photo_prefetcher.start(bot, message.from_user.id, 'diploma_file_id', photo.file_id)
+    
     is_editing = data.get('editing_mode', False)
     
     if is_editing:
@@ -513,13 +584,9 @@ async def invalid_diploma(message: types.Message):
 
 
 # Функция для отображения экрана просмотра данных
-async def show_review_screen(message: types.Message, state: FSMContext):
-    """Показывает экран просмотра данных перед подтверждением"""
-    from aiogram.types import InputMediaPhoto
-    
-    data = await state.get_data()
-    
-    review_text = (
+def build_review_text(data: dict) -> str:
+    """Текст карточки с данными участника"""
+    return (
         REVIEW_HEADER +
         REVIEW_FIO.format(fio=data.get('fio', 'N/A')) +
         REVIEW_PHARMACY_NAME.format(pharmacy_name=data.get('pharmacy_name', 'N/A')) +
@@ -530,70 +597,96 @@ async def show_review_screen(message: types.Message, state: FSMContext):
         REVIEW_CURATOR.format(curator=data.get('curator', 'N/A')) +
         REVIEW_PASSPORT_FRONT +
         REVIEW_PASSPORT_BACK +
-        REVIEW_DIPLOMA +
-        REVIEW_QUESTION
+        REVIEW_DIPLOMA
     )
+
+
+async def send_review_screen(message: types.Message, data: dict) -> dict:
+    """
+    Отправляет карточку с данными и альбом фото.
+    Возвращает описание экрана: id сообщений и показанные в них данные
+    """
+    review_text = build_review_text(data)
+    card = await message.answer(review_text, parse_mode="HTML")
+    review = {'card_id': card.message_id, 'text': review_text, 'album': {}, 'photos': {}}
     
-    review_keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=BUTTON_EDIT), KeyboardButton(text=BUTTON_CONFIRM)]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
+    # Собираем фото для альбома
+    media_group = build_photo_album(data)
+    fields = [field for field in PHOTO_CAPTIONS if data.get(field)]
     
-    # Отправляем карточку с данными
-    await message.answer(review_text, reply_markup=review_keyboard, parse_mode="HTML")
+    # Отправляем альбом фотографий
+    if media_group:
+        try:
+            album = await message.answer_media_group(media=media_group)
+            for field, album_message in zip(fields, album):
+                review['album'][field] = album_message.message_id
+                review['photos'][field] = data[field]
+        except Exception as e:
+            logger.error(f"Ошибка при отправке альбома фото: {e}")
     
-    # Собираем фото для альбома
-    media_group = []
+    return review
+
+
+async def update_review_screen(message: types.Message, review: dict, data: dict) -> dict:
+    """
+    Редактирует уже показанный экран: меняет только текст или фото,
+    которые изменились с прошлого показа
+    """
+    chat_id = message.chat.id
     
-    try:
-        passport_front_file_id = data.get('passport_front_file_id')
-        if passport_front_file_id:
-            media_group.append(
-                InputMediaPhoto(
-                    media=passport_front_file_id,
-                    caption="📸 <b>Лицевая сторона паспорта</b>",
-                    parse_mode="HTML"
-                )
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при подготовке фото паспорта (лицевая): {e}")
+    review_text = build_review_text(data)
+    if review_text != review['text']:
+        await message.bot.edit_message_text(
+            review_text, chat_id=chat_id, message_id=review['card_id'], parse_mode="HTML"
+        )
+        review['text'] = review_text
     
-    try:
-        passport_back_file_id = data.get('passport_back_file_id')
-        if passport_back_file_id:
-            media_group.append(
-                InputMediaPhoto(
-                    media=passport_back_file_id,
-                    caption="📸 <b>Обратная сторона паспорта</b>",
-                    parse_mode="HTML"
-                )
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при подготовке фото паспорта (обратная): {e}")
+    for field, caption in PHOTO_CAPTIONS.items():
+        file_id = data.get(field)
+        if file_id == review['photos'].get(field):
+            continue
+        if field not in review['album'] or not file_id:
+            # Альбом не совпадает с данными - показываем экран заново
+            raise ValueError(f"В альбоме экрана просмотра нет фото {field}")
+        await message.bot.edit_message_media(
+            InputMediaPhoto(media=file_id, caption=caption, parse_mode="HTML"),
+            chat_id=chat_id, message_id=review['album'][field]
+        )
+        review['photos'][field] = file_id
     
-    try:
-        diploma_file_id = data.get('diploma_file_id')
-        if diploma_file_id:
-            media_group.append(
-                InputMediaPhoto(
-                    media=diploma_file_id,
-                    caption="🎓 <b>Диплом</b>",
-                    parse_mode="HTML"
-                )
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при подготовке фото диплома: {e}")
+    return review
+
+
+async def show_review_screen(message: types.Message, state: FSMContext):
+    """
+    Показывает экран просмотра данных перед подтверждением.
+    Карточка и альбом отправляются один раз, при следующих показах они
+    редактируются на месте, а заново отправляется только вопрос с кнопками
+    """
+    data = await state.get_data()
     
-    # Отправляем альбом фотографий
-    if media_group:
+    review = data.get('review')
+    if review:
         try:
-            await message.answer_media_group(media=media_group)
+            review = await update_review_screen(message, review, data)
         except Exception as e:
-            logger.error(f"Ошибка при отправке альбома фото: {e}")
+            logger.warning(f"Не удалось обновить экран просмотра, отправляем заново: {e}")
+            review = None
+    if not review:
+        review = await send_review_screen(message, data)
+    
+    review_keyboard = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text=BUTTON_EDIT), KeyboardButton(text=BUTTON_CONFIRM)]
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+    
+    # Кнопки нельзя добавить к отредактированному сообщению - вопрос отправляем отдельно
+    await message.answer(REVIEW_QUESTION, reply_markup=review_keyboard)
     
+    await state.update_data(review=review)
     await state.set_state(RegistrationStates.reviewing_data)
 
 
@@ -702,63 +795,485 @@ async def process_edit_choice(message: types.Message, state: FSMContext):
         await message.answer(EDIT_FIELD_CHOICES)
 
 
+# Интервал обновления сообщения о ходе сборки архива, сек
+GETFILE_PROGRESS_INTERVAL = 2
+
+
+def format_export_progress(progress: ExportProgress) -> str:
+    """Текст сообщения о ходе сборки архива"""
+    if progress.volumes > 1:
+        return GETFILE_PROGRESS_VOLUMES.format(
+            volume=progress.volume, volumes=progress.volumes,
+            done=progress.done, total=progress.total
+        )
+    return GETFILE_PROGRESS.format(done=progress.done, total=progress.total)
+
+
+async def track_export_progress(status: types.Message, progress: ExportProgress, export: asyncio.Task):
+    """Обновляет сообщение о ходе сборки архива, пока идет выгрузка"""
+    last_text = None
+    while not export.done():
+        text = format_export_progress(progress)
+        if text != last_text:
+            try:
+                await status.edit_text(text)
+                last_text = text
+            except Exception as e:
+                logger.warning(f"Не удалось обновить прогресс архива: {e}")
+        await asyncio.wait({export}, timeout=GETFILE_PROGRESS_INTERVAL)
+
+
+async def send_export_volumes(
+    message: types.Message,
+    entries: list,
+    manifest: dict,
+    caption: str,
+    filename: str,
+    temp_path: Path,
+    keep_path: Optional[Path] = None
+) -> list:
+    """
+    Собирает и отправляет архив частями не больше EXPORT_VOLUME_MAX_BYTES.
+    Каждая часть отправляется сразу после сборки и удаляется с диска
+    (или переносится в keep_path, если архив нужно сохранить).
+    В первой части лежит оглавление: какие участники в какой части.
+    Возвращает описание отправленных частей
+    """
+    volumes = await storage_executor.run(None, plan_volumes, entries)
+    if len(volumes) == 1:
+        filenames = [filename]
+    else:
+        stem = Path(filename).stem
+        filenames = [f"{stem}.part{number:02d}.zip" for number in range(1, len(volumes) + 1)]
+    index = build_volume_index(volumes, manifest, filenames)
+    
+    sent_volumes = []
+    progress = ExportProgress()
+    progress.volumes = len(volumes)
+    status = await message.answer(format_export_progress(progress))
+    
+    for number, (volume_entries, volume_filename) in enumerate(zip(volumes, filenames), 1):
+        progress.volume = number
+        progress.done = 0
+        progress.total = len(volume_entries)
+        volume_manifest = dict(manifest, volume=number, volumes=len(volumes))
+        zip_file_path = temp_path / volume_filename
+        
+        # Файлы пишутся в архив прямо из папки data, в пуле потоков
+        export = asyncio.create_task(storage_executor.run(
+            None, build_archive, zip_file_path, volume_entries, progress,
+            volume_manifest, index if number == 1 else None
+        ))
+        await track_export_progress(status, progress, export)
+        files_count = await export
+        logger.info(f"ZIP архив собран: {zip_file_path}, файлов: {files_count}")
+        
+        await status.edit_text(GETFILE_SENDING)
+        
+        # Отправляем файл
+        file = FSInputFile(zip_file_path, filename=volume_filename)
+        volume_caption = caption
+        if len(volumes) > 1:
+            volume_caption = GETFILE_VOLUME_CAPTION.format(
+                caption=caption, volume=number, volumes=len(volumes)
+            )
+        sent = await message.answer_document(
+            file,
+            caption=volume_caption
+        )
+        logger.info(f"ZIP архив отправлен: {zip_file_path}")
+        
+        volume = {
+            'filename': volume_filename,
+            'file_id': sent.document.file_id,
+            'caption': volume_caption,
+            'path': None,
+        }
+        if keep_path is not None:
+            kept_path = keep_path / volume_filename
+            await storage_executor.run(None, shutil.move, str(zip_file_path), str(kept_path))
+            volume['path'] = str(kept_path)
+        else:
+            # Отправленная часть больше не нужна на диске
+            zip_file_path.unlink(missing_ok=True)
+        sent_volumes.append(volume)
+    
+    await status.delete()
+    return sent_volumes
+
+
+async def resend_cached_export(message: types.Message, cache: dict) -> bool:
+    """
+    Повторно отправляет закэшированный архив по file_id (без загрузки),
+    а если Telegram его не принял - файлом с диска
+    """
+    try:
+        for volume in cache['volumes']:
+            try:
+                await message.answer_document(volume['file_id'], caption=volume['caption'])
+            except Exception as e:
+                if not volume.get('path') or not Path(volume['path']).exists():
+                    raise
+                logger.warning(f"Не удалось отправить архив по file_id: {e}")
+                file = FSInputFile(volume['path'], filename=volume['filename'])
+                await message.answer_document(file, caption=volume['caption'])
+        return True
+    except Exception as e:
+        logger.error(f"Не удалось отправить закэшированный архив: {e}")
+        return False
+
+
+def parse_since_date(value: str) -> datetime:
+    """Разбирает дату из /getfile since=..."""
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d", "%d.%m.%Y %H:%M"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+
 # Обработчик команды /getfile
 @dp.message(Command("getfile"))
-async def cmd_getfile(message: types.Message):
-    """Создает и отправляет ZIP архив всей папки /data администратору"""
-    # Проверка прав (заменить на реальный ID администратора)
-    # ADMIN_ID переменная должна быть установлена
+async def cmd_getfile(message: types.Message, command: CommandObject):
+    """
+    Создает и отправляет ZIP архив администратору:
+    /getfile - вся папка /data
+    /getfile since - участники, добавленные после прошлой выгрузки
+    /getfile since=<дата> - участники, зарегистрированные с указанной даты
+    """
+    # Архив содержит фото паспортов, а full и delta сдвигают отметку выгрузки
+    if not is_admin(message):
+        await message.answer(NO_ACCESS)
+        return
+    
+    args = (command.args or "").strip()
+    since = None
+    since_text = args[len("since="):].strip()
+    if args.startswith("since="):
+        try:
+            since = parse_since_date(since_text)
+        except ValueError:
+            await message.answer(GETFILE_USAGE)
+            return
+    elif args not in ("", "since"):
+        await message.answer(GETFILE_USAGE)
+        return
     
     try:
         user_id = message.from_user.id
-        logger.info(f"Команда /getfile выполнена пользователем {user_id}")
+        logger.info(f"Команда /getfile {args} выполнена пользователем {user_id}")
         
-        # Создаем временную папку для архива
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_path = Path(temp_dir)
-            zip_path = temp_path / "data"
-            
-            # Копируем папку data в архив
-            if Path(DATA_PATH).exists():
-                shutil.copytree(DATA_PATH, zip_path)
-                logger.info(f"Папка {DATA_PATH} скопирована в архив")
-            
-            # Создаем ZIP архив
-            archive_path = temp_path / "registrations"
-            shutil.make_archive(
-                str(archive_path),
-                'zip',
-                root_dir=str(temp_path),
-                base_dir='data'
-            )
-            
-            zip_file_path = Path(str(archive_path) + '.zip')
             
-            if zip_file_path.exists():
-                # Отправляем файл
-                file = FSInputFile(zip_file_path, filename="registrations.zip")
-                await message.answer_document(
-                    file,
-                    caption=GETFILE_SUCCESS
+            if since is not None:
+                entries, manifest = await storage_executor.run(
+                    None, prepare_since_export, since, temp_path
+                )
+                if not entries:
+                    await message.answer(GETFILE_NOTHING_SINCE.format(since=since_text))
+                    return
+                caption = GETFILE_SINCE_SUCCESS.format(
+                    since=since_text, count=len(manifest["participants"])
                 )
-                logger.info(f"ZIP архив отправлен: {zip_file_path}")
+                filename = f"registrations_since_{since.strftime('%Y%m%d')}.zip"
+            elif args == "since":
+                entries, manifest = await storage_executor.run(None, prepare_delta_export, temp_path)
+                if not entries:
+                    await message.answer(GETFILE_NOTHING_NEW)
+                    return
+                caption = GETFILE_DELTA_SUCCESS.format(
+                    seq=manifest["seq"], count=len(manifest["participants"])
+                )
+                filename = f"registrations_delta_{manifest['seq']}.zip"
             else:
-                await message.answer(GETFILE_ERROR)
-                logger.error("ZIP архив не создан")
+                # Новых регистраций не было - отправляем прошлый архив
+                generation = await db_executor.run(store.db_path, store.get_generation)
+                cache = await storage_executor.run(None, load_export_cache)
+                if cache and cache.get('generation') == generation:
+                    if await resend_cached_export(message, cache):
+                        logger.info(f"Отправлен закэшированный архив (поколение {generation})")
+                        return
+                
+                # Сначала фиксируем участников выгрузки (до to_id), потом дописываем
+                # их в Excel и только после этого собираем файлы: в архиве есть
+                # строки и папки всех участников из manifest
+                manifest = await db_executor.run(store.db_path, prepare_full_export)
+                await excel_writer.flush(up_to=manifest["to_id"])
+                entries = await storage_executor.run(None, collect_data_entries)
+                cache_path = await storage_executor.run(None, prepare_export_cache_dir)
+                sent_volumes = await send_export_volumes(
+                    message, entries, manifest, GETFILE_SUCCESS, "registrations.zip",
+                    temp_path, keep_path=cache_path
+                )
+                await storage_executor.run(None, save_export_cache, generation, sent_volumes)
+                
+                # Следующая выгрузка since начнется после этой
+                await db_executor.run(store.db_path, commit_export, manifest)
+                return
+            
+            await send_export_volumes(message, entries, manifest, caption, filename, temp_path)
+            
+            # Следующая выгрузка since начнется после этой
+            await db_executor.run(store.db_path, commit_export, manifest)
     except Exception as e:
         logger.error(f"Ошибка при выполнении /getfile: {e}")
         await message.answer(f"❌ Ошибка: {str(e)}")
 
 
-async def main():
-    """Запуск бота"""
+def is_admin(message: types.Message) -> bool:
+    """Команда от администратора (если ADMIN_ID не задан - недоступна никому)"""
+    user_id = message.from_user.id if message.from_user is not None else None
+    if ADMIN_ID is None:
+        logger.warning(f"Команда {message.text} от {user_id} отклонена: ADMIN_ID не задан в настройках")
+        return False
+    return user_id == ADMIN_ID
+
+
+# Telegram принимает сообщения до 4096 символов (UTF-16) - берем с запасом под эмодзи
+MESSAGE_MAX_LENGTH = 4000
+
+
+def split_message(blocks: List[str], separator: str = "\n") -> List[str]:
+    """
+    Склеивает блоки текста в сообщения не длиннее MESSAGE_MAX_LENGTH.
+    Блок целиком попадает в одно сообщение; слишком длинный блок обрезается
+    """
+    messages: List[str] = []
+    current = ""
+    for block in blocks:
+        block = block[:MESSAGE_MAX_LENGTH]
+        if current and len(current) + len(separator) + len(block) > MESSAGE_MAX_LENGTH:
+            messages.append(current)
+            current = block
+        else:
+            current = current + separator + block if current else block
+    if current:
+        messages.append(current)
+    return messages
+
+
+# Обработчик команды /slow
+@dp.message(Command("slow"))
+async def cmd_slow(message: types.Message, command: CommandObject):
+    """
+    Самые долгие из последних регистраций с разбивкой по этапам:
+    /slow - десять самых долгих
+    /slow <N> - N самых долгих (не больше SLOW_COMMAND_MAX)
+    """
+    if not is_admin(message):
+        await message.answer(NO_ACCESS)
+        return
+    
+    args = (command.args or "").strip()
+    if args and not args.isdigit():
+        await message.answer(SLOW_USAGE.format(max=SLOW_COMMAND_MAX))
+        return
+    limit = min(int(args), SLOW_COMMAND_MAX) if args else 10
+    
+    traces = registration_tracer.slowest(limit)
+    if not traces:
+        await message.answer(SLOW_EMPTY)
+        return
+    
+    lines = [SLOW_HEADER.format(count=len(traces))]
+    for trace in traces:
+        lines.append(SLOW_ITEM.format(
+            time=trace.started_at.strftime('%d.%m %H:%M:%S'),
+            duration=trace.duration,
+            user_id=trace.user_id,
+            total_number=trace.total_number if trace.total_number is not None else "-",
+            curator=trace.curator or "-",
+            status="✅" if trace.ok else "❌",
+            stages=trace.breakdown() or "-"
+        ))
+    for text in split_message(lines, "\n\n"):
+        await message.answer(text)
+
+
+# Обработчик команды /stats
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """Число участников: всего, по кураторам, по дням и по должностям"""
+    if not is_admin(message):
+        await message.answer(NO_ACCESS)
+        return
+    
+    # Регистрации других процессов бота видны только в базе
+    if WORKERS > 1 or stats_service.behind:
+        await db_executor.run(store.db_path, stats_service.catch_up)
+    
+    stats = stats_service.snapshot()
+    lines = [STATS_HEADER.format(total=stats['total'], today=stats['today'])]
+    lines.append(STATS_CURATORS)
+    lines += [
+        STATS_ITEM.format(name=html.escape(curator), count=count)
+        for curator, count in stats['by_curator'].items()
+    ]
+    lines.append(STATS_DAYS.format(days=len(stats['by_day'])))
+    lines += [STATS_ITEM.format(name=day.strftime('%d.%m'), count=count) for day, count in stats['by_day']]
+    if stats['by_position']:
+        lines.append(STATS_POSITIONS)
+        lines += [
+            STATS_ITEM.format(name=html.escape(position) if position else STATS_NO_POSITION, count=count)
+            for position, count in stats['by_position']
+        ]
+        other_positions, other_count = stats['other_positions']
+        if other_positions:
+            lines.append(STATS_OTHER_POSITIONS.format(positions=other_positions, count=other_count))
+    for text in split_message(lines):
+        await message.answer(text, parse_mode="HTML")
+
+
+def prepare():
+    """Подготовка данных перед запуском (один раз, до старта процессов бота)"""
+    ensure_directories_exist()
+    photo_prefetcher.clear_all()
+    
+    # Переносим в базу участников, записанных до ее появления
+    if store.import_legacy_excel():
+        excel_writer.mark_all_exported()
+    
+    # Счетчики не меньше уже выданных номеров
+    counter_service.load()
+
+
+async def collect_runtime_metrics():
+    """Обновляет метрики, которые считаются по запросу /metrics"""
+    counts = await fsm_storage.count_by_state()
+    FSM_SESSIONS.replace({(state or "",): count for state, count in counts.items()})
+    
+    throttling = throttling_middleware.stats()
+    THROTTLED_UPDATES.set(throttling['dropped_rate'], reason="rate")
+    THROTTLED_UPDATES.set(throttling['dropped_media_group'], reason="media_group")
+
+
+async def shutdown_step(name: str, step: Callable[[], Any]):
+    """Шаг остановки бота: ошибка попадает в лог и не мешает следующим шагам"""
     try:
-        ensure_directories_exist()
-        logger.info("🤖 Бот запущен...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        result = step()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.error(f"Ошибка при остановке бота ({name}): {e}")
+
+
+async def serve(worker_id: int = 0, secret_token: Optional[str] = None):
+    """Обработка апдейтов до остановки бота"""
+    metrics_runner = None
+    try:
+        if METRICS_ENABLED:
+            registry.add_collector(collect_runtime_metrics)
+            metrics_runner = await start_metrics_server(METRICS_PORT + worker_id)
+        # Счетчики /stats собираются из базы один раз, дальше ведутся в памяти
+        await db_executor.run(store.db_path, stats_service.load)
+        await db_executor.run(store.db_path, duplicate_index.load)
+        excel_writer.start()
+        fsm_storage.start()
+        session_sweeper.start()
+        logger.info(f"🤖 Бот запущен (процесс {worker_id})...")
+        if WEBHOOK_URL:
+            await run_webhook(
+                dp, bot,
+                secret_token=secret_token,
+                register=worker_id == 0,
+                reuse_port=WORKERS > 1,
+                health_stats={"throttling": throttling_middleware.stats}
+            )
+        else:
+            # Polling не работает, пока в Telegram зарегистрирован webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
-        await bot.session.close()
+        logger.info(f"Ограничение частоты сообщений: {throttling_middleware.stats()}")
+        if metrics_runner is not None:
+            await shutdown_step("метрики", metrics_runner.cleanup)
+        await shutdown_step("очистка сессий", session_sweeper.stop)
+        await shutdown_step("скачивание фото", photo_prefetcher.close)
+        # Дожидаемся отправки сообщений, стоящих в очереди
+        await shutdown_step("очередь отправки", outbound_scheduler.close)
+        # Дописываем накопленные строки Excel перед выходом
+        await shutdown_step("выгрузка Excel", excel_writer.stop)
+        # При нескольких процессах снимок пишет родительский процесс
+        if WORKERS == 1:
+            await shutdown_step("снимок счетчиков", counter_service.save_snapshot)
+        # Сохраняем состояния незавершенных регистраций
+        await shutdown_step("состояния FSM", fsm_storage.close)
+        await shutdown_step("база регистраций", store.close)
+        await shutdown_step("пул операций с файлами", storage_executor.shutdown)
+        await shutdown_step("пул операций с базой", db_executor.shutdown)
+        await shutdown_step("сессия Bot API", bot.session.close)
+
+
+async def main():
+    """Запуск бота одним процессом"""
+    # SIGTERM (systemctl stop/restart) останавливает бота так же, как Ctrl+C -
+    # с сохранением данных. В режиме polling aiogram ставит свой обработчик
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    prepare()
+    await serve()
+
+
+def run_worker(worker_id: int, secret_token: str):
+    """Точка входа процесса бота"""
+    # SIGTERM останавливает процесс так же, как Ctrl+C - с сохранением данных
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve(worker_id, secret_token))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers():
+    """
+    Запуск WORKERS процессов бота на одном порту webhook.
+    Номера участников, состояния FSM и отметки выгрузки Excel процессы
+    берут из общей базы, запись Excel файлов защищена блокировками файлов
+    """
+    if not WEBHOOK_URL:
+        raise RuntimeError("Несколько процессов бота работают только через webhook (WEBHOOK_URL)")
+    
+    prepare()
+    store.close()
+    
+    # Секрет общий: webhook регистрирует один процесс, проверяют все
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(worker_id, secret_token), name=f"bot-worker-{worker_id}")
+        for worker_id in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    
+    def stop_workers(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    
+    signal.signal(signal.SIGTERM, stop_workers)
+    for process in processes:
+        while True:
+            try:
+                process.join()
+                break
+            except KeyboardInterrupt:
+                # Ctrl+C получают и сами процессы - ждем, пока они сохранят данные
+                continue
+        if process.exitcode:
+            logger.error(f"Процесс {process.name} завершился с кодом {process.exitcode}")
+    
+    # Все процессы остановлены - снимок счетчиков пишется один раз
+    counter_service.save_snapshot()
+    store.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKERS > 1:
+        run_workers()
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,150 @@
+"""
+Проверки webhook сервера: апдейты шлет тестовый клиент aiohttp так же,
+как Telegram, ответы бота уходят в замену Bot API из tools/loadtest.py
+"""
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from config.settings import WEBHOOK_PATH, HEALTH_PATH  # noqa: E402
+from tools.fake_telegram_sender import make_message_update  # noqa: E402
+from tools.loadtest import FakeBotAPI  # noqa: E402
+from utils.webhook import WEBHOOK_HANDLER_KEY, build_webhook_app  # noqa: E402
+
+SECRET = "test-secret"
+HEADERS = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+USER_ID = 1001
+
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.api = FakeBotAPI(api_latency=0, photo_size=16)
+        self.replies = self.api.register_user(USER_ID)
+        self.api_server = TestServer(self.api.build_app())
+        await self.api_server.start_server()
+
+        self.bot = Bot(
+            token="42:TEST",
+            session=AiohttpSession(api=TelegramAPIServer.from_base(str(self.api_server.make_url(""))))
+        )
+        # Обработчик ждет gate - так апдейты можно задержать в обработке
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.processed = []
+        self.dp = Dispatcher()
+
+        @self.dp.message()
+        async def echo(message: Message):
+            await self.gate.wait()
+            await message.answer(message.text)
+            self.processed.append(message.text)
+
+        self.client = None
+
+    async def asyncTearDown(self):
+        self.gate.set()
+        if self.client is not None:
+            await self.client.close()
+        await self.bot.session.close()
+        await self.api_server.close()
+
+    async def start(self, **kwargs):
+        """Поднимает webhook приложение и тестовый клиент к нему"""
+        self.app = build_webhook_app(self.dp, self.bot, secret_token=SECRET, **kwargs)
+        self.handler = self.app[WEBHOOK_HANDLER_KEY]
+        self.client = TestClient(TestServer(self.app))
+        await self.client.start_server()
+
+    async def post(self, text: str, headers=HEADERS):
+        response = await self.client.post(
+            WEBHOOK_PATH, json=make_message_update(USER_ID, text), headers=headers
+        )
+        await response.read()
+        return response.status
+
+    async def health(self):
+        response = await self.client.get(HEALTH_PATH)
+        self.assertEqual(response.status, 200)
+        return await response.json()
+
+    async def wait_for(self, condition, timeout: float = 5):
+        """Ждет, пока фоновая обработка дойдет до нужного состояния"""
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(poll(), timeout)
+
+    async def test_wrong_secret_rejected(self):
+        await self.start()
+        self.assertEqual(await self.post("чужой", headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}), 401)
+        self.assertEqual(await self.post("без секрета", headers={}), 401)
+        self.assertEqual(await self.post("свой"), 200)
+
+        self.assertEqual(await asyncio.wait_for(self.replies.get(), 5), "свой")
+        self.assertEqual(self.processed, ["свой"])
+
+    async def test_overloaded_queue_returns_503(self):
+        await self.start(max_concurrent=1, max_pending=1)
+        self.gate.clear()
+
+        self.assertEqual(await self.post("первый"), 200)
+        await self.wait_for(lambda: self.handler.running == 1)
+        self.assertEqual(await self.post("второй"), 200)
+        self.assertEqual(await self.post("третий"), 503)
+
+        stats = await self.health()
+        self.assertEqual(stats["status"], "ok")
+        self.assertEqual(
+            {key: stats[key] for key in ("pending", "running", "handled", "rejected")},
+            {"pending": 1, "running": 1, "handled": 0, "rejected": 1}
+        )
+
+        self.gate.set()
+        await self.wait_for(lambda: self.handler.handled == 2)
+        stats = await self.health()
+        self.assertEqual((stats["pending"], stats["running"], stats["handled"]), (0, 0, 2))
+        self.assertEqual(self.processed, ["первый", "второй"])
+        self.assertEqual(self.api.calls["sendMessage"], 2)
+
+    async def test_health_extra_stats(self):
+        await self.start(health_stats={"outbound": lambda: {"queued": 3}})
+        self.assertEqual((await self.health())["outbound"], {"queued": 3})
+
+    async def test_malformed_body_releases_pending(self):
+        await self.start(max_pending=1)
+        response = await self.client.post(WEBHOOK_PATH, data=b"not json", headers=HEADERS)
+        await response.read()
+        self.assertNotEqual(response.status, 200)
+        self.assertEqual((await self.health())["pending"], 0)
+        self.assertEqual(await self.post("после ошибки"), 200)
+
+    async def test_close_drains_accepted_updates(self):
+        await self.start()
+        self.gate.clear()
+        for text in ("раз", "два"):
+            self.assertEqual(await self.post(text), 200)
+        await self.wait_for(lambda: self.handler.running == 2)
+
+        # Остановка сервера дожидается апдейтов, которые уже приняты
+        asyncio.get_running_loop().call_later(0.1, self.gate.set)
+        await self.client.close()
+        self.client = None
+
+        self.assertEqual(sorted(self.processed), ["два", "раз"])
+        self.assertEqual(self.handler.stats()["handled"], 2)
+        self.assertEqual(self.api.calls["sendMessage"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
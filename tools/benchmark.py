@@ -0,0 +1,271 @@
+"""
+Замеры операций с Excel файлами, папками участников и базой на больших объемах.
+
+Для каждого размера (по умолчанию 1k, 10k и 100k участников) во временной
+папке заполняются общий Excel, Excel файлы кураторов, дерево папок data/
+и база регистраций, после чего каждая операция вызывается --repeat раз.
+Для каждой операции сохраняются время вызова (min/median/max), пиковая
+память (tracemalloc, отдельным вызовом) и размер файла после вызова.
+
+Пример:
+    python tools/benchmark.py --sizes 1000 10000 --output before.json
+    python tools/benchmark.py --sizes 1000 10000 --output after.json
+    python tools/benchmark.py --compare before.json after.json --threshold 20
+
+При сравнении операции, ставшие медленнее или прожорливее больше чем на
+--threshold процентов, выводятся как регрессии, код выхода - 1
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Пути в настройках относительные - все файлы создаются в текущей (временной) папке
+from config.settings import CURATORS  # noqa: E402
+from utils.excel_manager import (  # noqa: E402
+    append_rows_to_curator_excel,
+    append_rows_to_general_excel,
+    build_curator_row,
+    build_general_row,
+    create_or_update_curator_excel,
+    create_or_update_general_excel,
+    get_all_curators_excel_stats,
+    get_curator_excel_path,
+    get_general_excel_path,
+)
+from utils.file_manager import create_user_folder, ensure_directories_exist  # noqa: E402
+from utils.storage import RegistrationStore  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+BENCH_DB_FILE = "config/registrations.db"
+
+
+def make_participant(number: int) -> Dict[str, Any]:
+    """Синтетический участник с общим номером number"""
+    curator = CURATORS[number % len(CURATORS)]
+    return {
+        "curator": curator,
+        "fio": f"Участник Тестовый {number}",
+        "pharmacy_name": f"Аптека {number % 500}",
+        "pharmacy_number": str(number % 97),
+        "position": "Фармацевт" if number % 3 else "Заведующий",
+        "inn": f"{number:014d}",
+        "phone": f"+996{number % 10 ** 9:09d}",
+        "total_number": number,
+        "curator_number": number // len(CURATORS) + 1,
+        "user_id": number,
+        "username": f"user{number}",
+        "folder": "",
+    }
+
+
+def prefill(size: int) -> RegistrationStore:
+    """Заполняет Excel файлы, папки участников и базу size участниками"""
+    ensure_directories_exist()
+    participants = [make_participant(number) for number in range(1, size + 1)]
+
+    append_rows_to_general_excel([
+        build_general_row(
+            p["fio"], p["inn"], p["phone"], p["curator"], p["total_number"],
+            p["curator_number"], p["pharmacy_name"], p["pharmacy_number"], p["position"]
+        )
+        for p in participants
+    ])
+    for curator in CURATORS:
+        append_rows_to_curator_excel(curator, [
+            build_curator_row(
+                p["fio"], p["inn"], p["phone"], p["curator_number"], p["total_number"],
+                p["pharmacy_name"], p["pharmacy_number"], p["position"]
+            )
+            for p in participants if p["curator"] == curator
+        ])
+
+    store = RegistrationStore(BENCH_DB_FILE)
+    for p in participants:
+        p["folder"] = str(create_user_folder(p["curator"], p["fio"]))
+        store.add_participant(p)
+    store.seed_counters({})
+    return store
+
+
+def measure(
+    call: Callable[[int], Any],
+    repeat: int,
+    first_number: int,
+    size_of: Optional[Callable[[], int]] = None
+) -> Dict[str, Any]:
+    """
+    Вызывает call(number) repeat раз и еще раз под tracemalloc.
+    number - общий номер следующего участника, чтобы вызовы не повторялись
+    """
+    timings = []
+    for attempt in range(repeat):
+        started_at = time.perf_counter()
+        call(first_number + attempt)
+        timings.append(time.perf_counter() - started_at)
+
+    # tracemalloc замедляет код в разы - память меряем отдельным вызовом
+    tracemalloc.start()
+    call(first_number + repeat)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "max_s": max(timings),
+        "peak_memory_bytes": peak,
+        "file_size_bytes": size_of() if size_of else None,
+    }
+
+
+def run_size(size: int, repeat: int) -> Dict[str, Dict[str, Any]]:
+    """Все замеры для одного размера (в текущей папке)"""
+    started_at = time.perf_counter()
+    store = prefill(size)
+    print(f"  заполнено за {time.perf_counter() - started_at:.1f} с")
+
+    curator = CURATORS[0]
+    next_number = size + 1
+
+    def curator_excel(number: int):
+        p = make_participant(number)
+        create_or_update_curator_excel(
+            curator, p["fio"], p["inn"], p["phone"], p["curator_number"],
+            p["total_number"], "", p["pharmacy_name"], p["pharmacy_number"], p["position"]
+        )
+
+    def general_excel(number: int):
+        p = make_participant(number)
+        create_or_update_general_excel(
+            p["fio"], p["inn"], p["phone"], p["curator"], p["total_number"],
+            p["curator_number"], p["pharmacy_name"], p["pharmacy_number"], p["position"]
+        )
+
+    def register(number: int):
+        # Выдача номеров вместе с записью участника (бывший increment_counters)
+        store.register_participant(make_participant(number))
+
+    def user_folder(number: int):
+        create_user_folder(curator, f"Участник Тестовый {number}")
+
+    benchmarks = {
+        "create_or_update_curator_excel": (
+            curator_excel, lambda: get_curator_excel_path(curator).stat().st_size
+        ),
+        "create_or_update_general_excel": (
+            general_excel, lambda: get_general_excel_path().stat().st_size
+        ),
+        "get_all_curators_excel_stats": (
+            lambda number: get_all_curators_excel_stats(),
+            lambda: sum(get_curator_excel_path(c).stat().st_size for c in CURATORS)
+        ),
+        "register_participant": (
+            register, lambda: sum(p.stat().st_size for p in Path(BENCH_DB_FILE).parent.glob("registrations.db*"))
+        ),
+        "create_user_folder": (user_folder, None),
+    }
+
+    results = {}
+    for name, (call, size_of) in benchmarks.items():
+        result = measure(call, repeat, next_number, size_of)
+        next_number += repeat + 1
+        results[name] = result
+        print(
+            f"  {name:<34} median={result['median_s'] * 1000:>10.2f} мс  "
+            f"peak={result['peak_memory_bytes'] / 2 ** 20:>8.1f} МБ"
+        )
+    store.close()
+    return results
+
+
+def run(sizes: List[int], repeat: int, workdir: Optional[str]) -> Dict[str, Any]:
+    """Замеры для всех размеров, каждый в своей папке"""
+    base = Path(workdir or tempfile.mkdtemp(prefix="bot-benchmark-")).resolve()
+    cwd = os.getcwd()
+    results: Dict[str, Any] = {}
+    try:
+        for size in sizes:
+            size_dir = base / str(size)
+            size_dir.mkdir(parents=True, exist_ok=True)
+            os.chdir(size_dir)
+            print(f"{size} участников ({size_dir}):")
+            for name, result in run_size(size, repeat).items():
+                results[f"{name}@{size}"] = {"benchmark": name, "size": size, **result}
+    finally:
+        os.chdir(cwd)
+        # Временную папку убираем, заданную пользователем оставляем для разбора
+        if workdir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Сравнивает два файла результатов. Возвращает число регрессий"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)["results"]
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+
+    regressions = 0
+    print(f"{'замер':<44}{'было, мс':>12}{'стало, мс':>12}{'время':>9}{'память':>9}")
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (old[k]["benchmark"], old[k]["size"])):
+        before, after = old[key], new[key]
+        time_change = (after["median_s"] / before["median_s"] - 1) * 100 if before["median_s"] else 0.0
+        memory_change = (
+            (after["peak_memory_bytes"] / before["peak_memory_bytes"] - 1) * 100
+            if before["peak_memory_bytes"] else 0.0
+        )
+        regressed = time_change > threshold or memory_change > threshold
+        regressions += regressed
+        print(
+            f"{key:<44}{before['median_s'] * 1000:>12.2f}{after['median_s'] * 1000:>12.2f}"
+            f"{time_change:>+8.0f}%{memory_change:>+8.0f}%" + ("  РЕГРЕССИЯ" if regressed else "")
+        )
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"{key:<44}есть только в {'первом' if key in old else 'втором'} файле")
+    print(f"\nРегрессий больше {threshold:.0f}%: {regressions}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры операций с Excel, папками и базой")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Число участников")
+    parser.add_argument("--repeat", type=int, default=5, help="Вызовов каждой операции")
+    parser.add_argument("--output", default=None, help="Куда сохранить результаты (JSON)")
+    parser.add_argument("--workdir", default=None, help="Папка для файлов (по умолчанию временная)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Сравнить два файла результатов")
+    parser.add_argument("--threshold", type=float, default=20, help="Порог регрессии, %%")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    report = run(args.sizes, args.repeat, args.workdir)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
@@ -0,0 +1,110 @@
+"""
+Имитация Telegram: отправляет апдейты на webhook бота, запущенного локально.
+
+Пример:
+    python tools/fake_telegram_sender.py --url http://127.0.0.1:8080/webhook \
+        --secret <WEBHOOK_SECRET> --users 50 --updates 5
+
+Каждый пользователь шлет /start и несколько текстовых сообщений. В конце
+печатаются коды ответов, задержки приема и содержимое /health
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from aiohttp import ClientSession
+
+_update_ids = itertools.count(1)
+
+
+def make_message_update(user_id: int, text: str) -> Dict[str, Any]:
+    """Апдейт с текстовым сообщением пользователя в личном чате"""
+    update_id = next(_update_ids)
+    update = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+                     "username": f"user{user_id}"},
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        update["message"]["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+        ]
+    return update
+
+
+async def send_update(
+    session: ClientSession,
+    url: str,
+    secret: Optional[str],
+    update: Dict[str, Any],
+    statuses: Counter,
+    latencies: List[float]
+):
+    """Отправляет один апдейт так же, как это делает Telegram"""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    started_at = time.perf_counter()
+    async with session.post(url, json=update, headers=headers) as response:
+        await response.read()
+        statuses[response.status] += 1
+    latencies.append(time.perf_counter() - started_at)
+
+
+async def simulate_user(session, url, secret, user_id, updates, statuses, latencies):
+    """Сообщения одного пользователя идут по порядку, как в Telegram"""
+    await send_update(session, url, secret, make_message_update(user_id, "/start"), statuses, latencies)
+    for number in range(updates - 1):
+        await send_update(
+            session, url, secret, make_message_update(user_id, f"Сообщение {number}"),
+            statuses, latencies
+        )
+
+
+async def main(args):
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    started_at = time.perf_counter()
+
+    async with ClientSession() as session:
+        await asyncio.gather(*(
+            simulate_user(session, args.url, args.secret, args.first_user_id + i,
+                          args.updates, statuses, latencies)
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started_at
+
+        parts = urlsplit(args.url)
+        async with session.get(f"{parts.scheme}://{parts.netloc}{args.health_path}") as response:
+            health = await response.text()
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"Отправлено апдейтов: {total} за {elapsed:.2f} с ({total / elapsed:.1f}/с)")
+    print(f"Коды ответов: {dict(statuses)}")
+    if latencies:
+        print(
+            f"Задержка приема: p50={latencies[total // 2] * 1000:.1f} мс, "
+            f"p95={latencies[int(total * 0.95)] * 1000:.1f} мс, "
+            f"max={latencies[-1] * 1000:.1f} мс"
+        )
+    print(f"{args.health_path}: {health}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправка фейковых апдейтов на webhook бота")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None, help="Значение WEBHOOK_SECRET")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--updates", type=int, default=3, help="Апдейтов от каждого пользователя")
+    parser.add_argument("--first-user-id", type=int, default=100000)
+    parser.add_argument("--health-path", default="/health")
+    asyncio.run(main(parser.parse_args()))
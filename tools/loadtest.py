@@ -0,0 +1,352 @@
+"""
+Нагрузочный тест полной регистрации: от /start до "Подтвердить".
+
+Поднимает локальную замену Telegram Bot API (getUpdates, sendMessage,
+sendMediaGroup, getFile, скачивание файлов и остальные методы, которые
+вызывает бот) и запускает настоящий диспетчер dp из main.py в режиме polling.
+N имитированных пользователей проходят регистрацию параллельно: каждый шлет
+следующий шаг только после ответа бота на предыдущий, как живой человек.
+
+Пример:
+    python tools/loadtest.py --users 200 --ramp 10 --api-latency 50
+
+Бот работает в отдельной временной папке (data/, config/*.db, Excel файлы),
+рабочие данные не затрагиваются. В конце печатаются пропускная способность,
+p50/p95/p99 времени ответа по шагам, ошибки и число запросов к Bot API.
+Фейковый API работает в том же процессе, что и бот, поэтому его работа
+тоже входит в замеренное время
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Тексты и настройки не зависят от рабочей папки, main импортируется позже
+from config.messages import (  # noqa: E402
+    START_WELCOME, CURATOR_CONFIRMED, FIO_CONFIRMED, PHARMACY_NAME_CONFIRMED,
+    PHARMACY_NUMBER_CONFIRMED, POSITION_CONFIRMED, INN_CONFIRMED,
+    PASSPORT_FRONT_REQUEST, PASSPORT_FRONT_CONFIRMED, PASSPORT_BACK_CONFIRMED,
+    REVIEW_QUESTION, REGISTRATION_SUCCESS, BUTTON_POSITION_PHARMACIST, BUTTON_CONFIRM,
+    WARNING_THROTTLED
+)
+from config.settings import CURATORS  # noqa: E402
+
+BOT_ID = 1
+GETUPDATES_LIMIT = 100
+
+
+def expected_prefix(template: str) -> str:
+    """Неизменная начальная часть текста ответа"""
+    return template.split("{")[0]
+
+
+class FakeBotAPI:
+    """
+    Замена api.telegram.org. Апдейты пользователей отдаются через getUpdates,
+    сообщения бота пользователям попадают в их очереди ответов
+    """
+
+    def __init__(self, api_latency: float, photo_size: int):
+        self.api_latency = api_latency
+        self.photo = os.urandom(photo_size)
+        self.calls: Counter = Counter()
+        self._updates: List[Dict[str, Any]] = []
+        self._has_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._replies: Dict[int, asyncio.Queue] = {}
+
+    def register_user(self, user_id: int) -> asyncio.Queue:
+        """Очередь сообщений бота этому пользователю"""
+        return self._replies.setdefault(user_id, asyncio.Queue())
+
+    def push_update(self, message: Dict[str, Any]):
+        """Сообщение пользователя - в очередь getUpdates"""
+        message["message_id"] = next(self._message_ids)
+        message["date"] = int(time.time())
+        self._updates.append({"update_id": next(self._update_ids), "message": message})
+        self._has_updates.set()
+
+    def _message(self, chat_id: int, **fields: Any) -> Dict[str, Any]:
+        """Сообщение, отправленное ботом"""
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "LoadTestBot"},
+            **fields,
+        }
+
+    def _deliver(self, chat_id: int, text: str):
+        queue = self._replies.get(chat_id)
+        if queue is not None:
+            queue.put_nowait(text)
+
+    async def _get_updates(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        # Подтвержденные ботом апдейты больше не отдаем
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:GETUPDATES_LIMIT]
+
+    def _photo_message(self, chat_id: int) -> Dict[str, Any]:
+        file_id = f"sent-{next(self._message_ids)}"
+        return self._message(chat_id, photo=[{
+            "file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960
+        }])
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        chat_id = int(params.get("chat_id") or 0)
+        if method == "getMe":
+            result: Any = {"id": BOT_ID, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            self._deliver(chat_id, params.get("text", ""))
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            result = [self._photo_message(chat_id) for _ in media]
+        elif method in ("sendPhoto", "editMessageMedia"):
+            result = self._photo_message(chat_id)
+        elif method == "copyMessages":
+            message_ids = json.loads(params.get("message_ids") or "[]")
+            result = [{"message_id": next(self._message_ids)} for _ in message_ids]
+        elif method == "getFile":
+            file_id = params["file_id"]
+            result = {
+                "file_id": file_id, "file_unique_id": file_id,
+                "file_size": len(self.photo), "file_path": f"photos/{file_id}.jpg"
+            }
+        else:
+            # deleteWebhook, setMyCommands и т.п.
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.calls["download"] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        return web.Response(body=self.photo, content_type="image/jpeg")
+
+    def build_app(self) -> web.Application:
+        """Приложение aiohttp с методами Bot API и скачиванием файлов"""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        return app
+
+    async def start(self, host: str, port: int) -> web.AppRunner:
+        runner = web.AppRunner(self.build_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def build_steps(user_id: int, index: int) -> List[Tuple[str, Callable[[], Dict[str, Any]], str]]:
+    """Шаги регистрации: имя, сообщение пользователя, начало ожидаемого ответа"""
+    def text(value: str) -> Callable[[], Dict[str, Any]]:
+        def make() -> Dict[str, Any]:
+            message: Dict[str, Any] = {"text": value}
+            if value.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(value)}]
+            return message
+        return make
+
+    def photo(field: str) -> Callable[[], Dict[str, Any]]:
+        file_id = f"loadtest-{user_id}-{field}"
+        return lambda: {"photo": [{
+            "file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960
+        }]}
+
+    return [
+        ("start", text("/start"), expected_prefix(START_WELCOME)),
+        ("curator", text(CURATORS[index % len(CURATORS)]), expected_prefix(CURATOR_CONFIRMED)),
+        ("fio", text(f"Нагрузочный Тест {user_id}"), expected_prefix(FIO_CONFIRMED)),
+        ("pharmacy_name", text(f"Аптека {index}"), expected_prefix(PHARMACY_NAME_CONFIRMED)),
+        ("pharmacy_number", text(str(index)), expected_prefix(PHARMACY_NUMBER_CONFIRMED)),
+        ("position", text(BUTTON_POSITION_PHARMACIST), expected_prefix(POSITION_CONFIRMED)),
+        ("inn", text(f"{user_id:014d}"), expected_prefix(INN_CONFIRMED)),
+        ("phone", text(f"+996{user_id % 10 ** 9:09d}"), expected_prefix(PASSPORT_FRONT_REQUEST)),
+        ("passport_front", photo("passport_front"), expected_prefix(PASSPORT_FRONT_CONFIRMED)),
+        ("passport_back", photo("passport_back"), expected_prefix(PASSPORT_BACK_CONFIRMED)),
+        ("diploma", photo("diploma"), expected_prefix(REVIEW_QUESTION)),
+        ("confirm", text(BUTTON_CONFIRM), expected_prefix(REGISTRATION_SUCCESS)),
+    ]
+
+
+class LoadTestReport:
+    """Времена ответов по шагам и ошибки"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.completed = 0
+
+    def print(self, elapsed: float, users: int, api_calls: Counter, group_backlog: int):
+        print(f"\nПользователей: {users}, завершили регистрацию: {self.completed} за {elapsed:.2f} с")
+        print(f"Пропускная способность: {self.completed / elapsed:.2f} регистраций/с, "
+              f"{sum(len(values) for values in self.latencies.values()) / elapsed:.1f} шагов/с")
+        print(f"\n{'шаг':<16}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+        for step, values in self.latencies.items():
+            values.sort()
+            print(
+                f"{step:<16}{len(values):>7}"
+                f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}{values[-1] * 1000:>10.1f}"
+            )
+        print(f"\nОшибки: {dict(self.errors) or 'нет'}")
+        print(f"Запросы к Bot API: {dict(api_calls.most_common())}")
+        # Отправку в группы сдерживает OUTBOUND_GROUP_RATE - это не ошибка
+        print(f"Сообщений в группы в очереди на момент окончания: {group_backlog}")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль отсортированного списка (по ближайшему рангу)"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+async def simulate_user(
+    api: FakeBotAPI,
+    report: LoadTestReport,
+    user_id: int,
+    index: int,
+    delay: float,
+    think_time: float,
+    step_timeout: float
+):
+    """Один пользователь проходит регистрацию, дожидаясь ответа на каждый шаг"""
+    await asyncio.sleep(delay)
+    replies = api.register_user(user_id)
+    sender = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+    async def wait_reply(expected: str) -> Optional[str]:
+        """Ждет ожидаемый ответ; возвращает текст ошибки бота, если пришла она"""
+        while True:
+            reply = await replies.get()
+            if reply.startswith(expected):
+                return None
+            # Ошибки бота начинаются с ❌, остальные сообщения (карточка просмотра) пропускаем
+            if reply.startswith("❌") or reply == WARNING_THROTTLED:
+                return reply.splitlines()[0][:60]
+
+    for number, (step, make_message, expected) in enumerate(build_steps(user_id, index)):
+        if number:
+            # Человек читает ответ и печатает следующий шаг
+            await asyncio.sleep(think_time)
+        started_at = time.perf_counter()
+        api.push_update({"chat": chat, "from": sender, **make_message()})
+        try:
+            error = await asyncio.wait_for(wait_reply(expected), step_timeout)
+        except asyncio.TimeoutError:
+            error = f"нет ответа за {step_timeout:.0f} с"
+        if error:
+            report.errors[f"{step}: {error}"] += 1
+            return
+        report.latencies[step].append(time.perf_counter() - started_at)
+
+    report.completed += 1
+
+
+async def run(args: argparse.Namespace):
+    api = FakeBotAPI(args.api_latency / 1000, args.photo_size * 1024)
+    api_runner = await api.start(args.host, args.port)
+
+    # main импортируется уже во временной папке: пути в настройках относительные
+    import main
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from config.settings import BOT_TOKEN
+    from utils.metrics import ApiMetricsMiddleware
+
+    if args.no_metrics:
+        main.METRICS_ENABLED = False
+    if args.no_throttle:
+        main.throttling_middleware.limit = float("inf")
+    main.bot = Bot(
+        token=BOT_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://{args.host}:{args.port}"))
+    )
+    main.bot.session.middleware(ApiMetricsMiddleware())
+
+    main.prepare()
+    bot_task = asyncio.create_task(main.serve())
+
+    report = LoadTestReport()
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            simulate_user(
+                api, report, args.first_user_id + index, index,
+                args.ramp * index / args.users, args.think_time, args.step_timeout
+            )
+            for index in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started_at
+        group_backlog = main.outbound_scheduler.queue_depth
+    finally:
+        await main.dp.stop_polling()
+        await bot_task
+        await api_runner.cleanup()
+
+    report.print(elapsed, args.users, api.calls, group_backlog)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест регистрации с фейковым Bot API")
+    parser.add_argument("--users", type=int, default=50, help="Число имитированных пользователей")
+    parser.add_argument("--ramp", type=float, default=0, help="За сколько секунд подключаются все пользователи")
+    parser.add_argument("--api-latency", type=float, default=0, help="Задержка ответа Bot API, мс")
+    parser.add_argument("--photo-size", type=int, default=200, help="Размер скачиваемого фото, КБ")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="Пауза пользователя между шагами, с (меньше 0.6 с упирается в THROTTLE_LIMIT)")
+    parser.add_argument("--no-throttle", action="store_true", help="Отключить ограничение частоты сообщений")
+    parser.add_argument("--step-timeout", type=float, default=60, help="Сколько ждать ответа на шаг, с")
+    parser.add_argument("--first-user-id", type=int, default=100000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081, help="Порт фейкового Bot API")
+    parser.add_argument("--workdir", default=None, help="Папка для данных бота (по умолчанию временная)")
+    parser.add_argument("--no-metrics", action="store_true", help="Не поднимать эндпоинт /metrics")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bot-loadtest-")
+    Path(workdir, "config").mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+    print(f"Данные бота: {workdir}")
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
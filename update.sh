@@ -29,11 +29,28 @@ source venv/bin/activate
 echo "✅ Виртуальное окружение активировано"
 echo ""
 
+# Снимок базы SQLite: копировать файл базы (и -wal) во время работы бота нельзя
+backup_db() {
+    if command -v sqlite3 &> /dev/null; then
+        sqlite3 "$1" ".backup '$2'"
+    else
+        python -c "import sqlite3, sys; sqlite3.connect(sys.argv[1]).backup(sqlite3.connect(sys.argv[2]))" "$1" "$2"
+    fi
+}
+
 # Создать резервную копию
 echo "💾 Создание резервной копии..."
 mkdir -p backups
 BACKUP_NAME="backup_$(date +%Y%m%d_%H%M%S).tar.gz"
-tar -czf "backups/$BACKUP_NAME" data/ config/*.json config/*.xlsx 2>/dev/null || true
+SNAPSHOT_DIR=$(mktemp -d)
+mkdir -p "$SNAPSHOT_DIR/config"
+for DB in config/registrations.db config/fsm.db; do
+    if [ -f "$DB" ]; then
+        backup_db "$DB" "$SNAPSHOT_DIR/$DB"
+    fi
+done
+tar -czf "backups/$BACKUP_NAME" data/ config/*.json config/*.xlsx -C "$SNAPSHOT_DIR" config 2>/dev/null || true
+rm -rf "$SNAPSHOT_DIR"
 echo "✅ Резервная копия создана: $BACKUP_NAME"
 echo ""
 
@@ -73,6 +90,8 @@ echo ""
 echo "Резервная копия сохранена: backups/$BACKUP_NAME"
 echo ""
 echo "Если появились ошибки, восстановитесь из резервной копии:"
+echo "  sudo systemctl stop mama-bot"
+echo "  rm -f config/*.db-wal config/*.db-shm"
 echo "  tar -xzf backups/$BACKUP_NAME"
-echo "  sudo systemctl restart mama-bot"
+echo "  sudo systemctl start mama-bot"
 echo ""
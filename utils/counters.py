@@ -0,0 +1,74 @@
+"""
+Счетчики участников (общий номер и номер у куратора)
+"""
+import json
+import logging
+import os
+from typing import Dict
+
+from config.settings import CURATORS, COUNTERS_JOURNAL_FILE
+from utils.file_manager import load_counters, save_counters
+from utils.storage import RegistrationStore, store
+
+logger = logging.getLogger(__name__)
+
+
+class CounterService:
+    """
+    Счетчики живут в таблице counters базы регистраций, номера выдаются
+    в одной транзакции с записью участника (RegistrationStore.register_participant),
+    поэтому они уникальны и идут без пропусков даже при нескольких процессах бота.
+
+    config/counters.json остается снимком для чтения человеком: при запуске
+    его значения (и журнал counters.journal от прежних версий) переносятся
+    в базу, при остановке снимок перезаписывается из базы.
+    """
+
+    def __init__(
+        self,
+        registration_store: RegistrationStore = store,
+        journal_file: str = COUNTERS_JOURNAL_FILE
+    ):
+        self.store = registration_store
+        self.journal_file = journal_file
+
+    def _load_legacy(self) -> Dict[str, int]:
+        """Снимок counters.json с примененным журналом прежних версий"""
+        counters = load_counters()
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная строка при сбое - номер по ней не выдавался
+                        logger.warning(f"Пропущена поврежденная запись журнала счетчиков: {line!r}")
+                        continue
+                    counters["total"] = max(counters.get("total", 0), entry["total"])
+                    curator = entry["curator"]
+                    counters[curator] = max(counters.get(curator, 0), entry["curator_number"])
+        return counters
+
+    def load(self):
+        """Переносит значения из counters.json и журнала в базу"""
+        self.store.seed_counters(self._load_legacy())
+        # Журнал уже учтен в базе
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        logger.info(f"Счетчики загружены: Общий={self.counters.get('total', 0)}")
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        """Текущие значения счетчиков"""
+        counters = self.store.get_counters()
+        counters.setdefault("total", 0)
+        for curator in CURATORS:
+            counters.setdefault(curator, 0)
+        return counters
+
+    def save_snapshot(self):
+        """Перезаписывает counters.json значениями из базы"""
+        save_counters(self.counters)
+
+
+counter_service = CounterService()
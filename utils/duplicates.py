@@ -0,0 +1,100 @@
+"""
+Поиск повторных регистраций по ИНН и телефону
+"""
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from config.settings import WORKERS
+from utils.executor import db_executor
+from utils.storage import RegistrationStore, StoreView, store
+
+logger = logging.getLogger(__name__)
+
+
+class Registration(NamedTuple):
+    """Уже зарегистрированный участник с совпавшими данными"""
+    total_number: int
+    curator: str
+    fio: str
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Телефон без знаков и с кодом страны: 0701234567 и +996 701 234 567 -> 996701234567"""
+    if not phone:
+        return None
+    digits = "".join(c for c in str(phone) if c.isdigit())
+    if len(digits) == 10 and digits.startswith("0"):
+        digits = "996" + digits[1:]
+    return digits or None
+
+
+class DuplicateIndex(StoreView):
+    """
+    Словари ИНН -> участники и телефон -> участники в памяти. При запуске
+    заполняются из базы, дальше пополняются при каждой регистрации, так
+    что проверка на шаге ввода ИНН или телефона не ходит ни в базу, ни в Excel.
+    Записи других процессов бота дочитываются перед поиском
+    """
+
+    def __init__(self, registration_store: RegistrationStore = store):
+        super().__init__(registration_store)
+        self._by_inn: Dict[str, List[Registration]] = {}
+        self._by_phone: Dict[str, List[Registration]] = {}
+
+    def _add(self, row: Dict[str, Any]):
+        registration = Registration(row["total_number"], row["curator"], row["fio"])
+        inn = str(row["inn"]).strip() if row.get("inn") else None
+        phone = normalize_phone(row.get("phone"))
+        if inn:
+            self._by_inn.setdefault(inn, []).append(registration)
+        if phone:
+            self._by_phone.setdefault(phone, []).append(registration)
+
+    def _clear(self):
+        self._by_inn.clear()
+        self._by_phone.clear()
+
+    def _apply_rows(self, after_id: int) -> int:
+        rows = self.store.get_identities(after_id)
+        for row in rows:
+            self._add(row)
+        return rows[-1]["id"] if rows else after_id
+
+    def load(self):
+        """Строит индекс по базе заново"""
+        super().load()
+        logger.info(
+            f"Индекс дублей загружен: ИНН {len(self._by_inn)}, телефонов {len(self._by_phone)}"
+        )
+
+    def add(self, participant_id: int, record: Dict[str, Any]):
+        """Добавляет только что записанного участника"""
+        self._record(participant_id, lambda: self._add(record))
+
+    def find(
+        self,
+        inn: Optional[str] = None,
+        phone: Optional[str] = None
+    ) -> List[Tuple[str, Registration]]:
+        """Совпадения по ИНН и телефону: список (поле, участник)"""
+        matches = []
+        with self._lock:
+            if inn:
+                matches += [("inn", r) for r in self._by_inn.get(str(inn).strip(), ())]
+            phone = normalize_phone(phone)
+            if phone:
+                matches += [("phone", r) for r in self._by_phone.get(phone, ())]
+        return matches
+
+
+duplicate_index = DuplicateIndex()
+
+
+async def find_duplicates(
+    inn: Optional[str] = None,
+    phone: Optional[str] = None
+) -> List[Tuple[str, Registration]]:
+    """Совпадения по ИНН и телефону с учетом регистраций других процессов бота"""
+    if WORKERS > 1 or duplicate_index.behind:
+        await db_executor.run(store.db_path, duplicate_index.catch_up)
+    return duplicate_index.find(inn, phone)
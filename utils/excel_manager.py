@@ -4,6 +4,7 @@
 import os
 from pathlib import Path
 from datetime import datetime
+from typing import List, Optional
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
@@ -16,6 +17,183 @@ def get_curator_excel_path(curator: str) -> Path:
     return curator_path / f"{curator}_participants.xlsx"
 
 
+def get_general_excel_path() -> Path:
+    """Получает путь к общему файлу Excel"""
+    return Path(DATA_PATH) / "Все_участники.xlsx"
+
+
+def _thin_border() -> Border:
+    """Тонкая рамка для ячеек"""
+    return Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+
+
+def _write_headers(ws, headers: List[str], color: str, widths: List[int]):
+    """Записывает строку заголовков и ширину колонок"""
+    header_fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF", size=11)
+    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    thin_border = _thin_border()
+    
+    for col_num, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col_num)
+        cell.value = header
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        cell.border = thin_border
+    
+    # Устанавливаем ширину колонок
+    for col_num, width in enumerate(widths):
+        ws.column_dimensions[chr(ord('A') + col_num)].width = width
+
+
+def _save_workbook(wb, excel_path: Path):
+    """
+    Сохраняет книгу через временный файл: другие процессы и выгрузка
+    /getfile никогда не видят наполовину записанный файл
+    """
+    excel_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = excel_path.with_name(f".{excel_path.name}.tmp")
+    wb.save(tmp_path)
+    os.replace(tmp_path, excel_path)
+
+
+def _append_rows(ws, start_row: int, rows: List[list]):
+    """Добавляет строки с данными начиная с указанной строки"""
+    data_alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    number_alignment = Alignment(horizontal="center", vertical="center")
+    thin_border = _thin_border()
+    
+    for row_offset, row_data in enumerate(rows):
+        for col_num, value in enumerate(row_data, 1):
+            cell = ws.cell(row=start_row + row_offset, column=col_num)
+            cell.value = value
+            cell.alignment = data_alignment
+            cell.border = thin_border
+            
+            # Выравнивание для чисел
+            if col_num in [1, 2]:
+                cell.alignment = number_alignment
+
+
+def build_curator_row(
+    fio: str,
+    inn: str,
+    phone: str,
+    curator_number: int,
+    total_number: int,
+    pharmacy_name: str = "",
+    pharmacy_number: str = "",
+    position: str = "",
+    registered_at: Optional[datetime] = None
+) -> list:
+    """Формирует строку для Excel файла куратора"""
+    registered_at = registered_at or datetime.now()
+    return [
+        curator_number,                          # №
+        total_number,                            # Общий №
+        fio,                                     # ФИО
+        pharmacy_name or "",                     # Аптека
+        pharmacy_number or "",                   # Номер аптеки
+        position or "",                          # Должность
+        inn,                                     # ИНН
+        phone,                                   # Телефон
+        registered_at.strftime("%d.%m.%Y %H:%M"),  # Дата регистрации
+    ]
+
+
+def build_general_row(
+    fio: str,
+    inn: str,
+    phone: str,
+    curator: str,
+    total_number: int,
+    curator_number: int,
+    pharmacy_name: str = "",
+    pharmacy_number: str = "",
+    position: str = "",
+    registered_at: Optional[datetime] = None
+) -> list:
+    """Формирует строку для общего Excel файла"""
+    registered_at = registered_at or datetime.now()
+    return [
+        total_number,                            # Общий №
+        curator_number,                          # № у куратора
+        fio,                                     # ФИО
+        pharmacy_name or "",                     # Аптека
+        pharmacy_number or "",                   # Номер аптеки
+        position or "",                          # Должность
+        inn,                                     # ИНН
+        phone,                                   # Телефон
+        curator,                                 # Куратор
+        registered_at.strftime("%d.%m.%Y %H:%M"),  # Дата регистрации
+    ]
+
+
+def append_rows_to_curator_excel(curator: str, rows: List[list]):
+    """
+    Добавляет несколько строк в Excel файл куратора за одно сохранение
+    """
+    excel_path = get_curator_excel_path(curator)
+    
+    # Проверяем, существует ли файл
+    if excel_path.exists():
+        wb = load_workbook(excel_path)
+        ws = wb.active
+        # Находим последнюю заполненную строку
+        next_row = ws.max_row + 1
+    else:
+        # Создаем новый файл
+        wb = Workbook()
+        ws = wb.active
+        ws.title = curator
+        
+        # Создаем заголовки (без колонны "Путь")
+        headers = ["№", "Общий №", "ФИО", "Аптека", "Номер аптеки", "Должность", "ИНН", "Телефон", "Дата регистрации"]
+        _write_headers(ws, headers, "4472C4", [6, 10, 25, 25, 12, 15, 15, 15, 20])
+        next_row = 2
+    
+    _append_rows(ws, next_row, rows)
+    
+    # Сохраняем файл
+    _save_workbook(wb, excel_path)
+
+
+def append_rows_to_general_excel(rows: List[list], excel_path: Optional[Path] = None):
+    """
+    Добавляет несколько строк в общий Excel файл за одно сохранение.
+    excel_path - другой файл того же формата (по умолчанию общий файл)
+    """
+    general_excel_path = excel_path or get_general_excel_path()
+    
+    # Проверяем, существует ли файл
+    if general_excel_path.exists():
+        wb = load_workbook(general_excel_path)
+        ws = wb.active
+        # Находим последнюю заполненную строку
+        next_row = ws.max_row + 1
+    else:
+        # Создаем новый файл
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Участники"
+        
+        # Создаем заголовки
+        headers = ["Общий №", "№ у куратора", "ФИО", "Аптека", "Номер аптеки", "Должность", "ИНН", "Телефон", "Куратор", "Дата регистрации"]
+        _write_headers(ws, headers, "2F5496", [12, 12, 25, 25, 12, 15, 15, 15, 15, 20])
+        next_row = 2
+    
+    _append_rows(ws, next_row, rows)
+    
+    # Сохраняем файл
+    _save_workbook(wb, general_excel_path)
+
+
 def create_or_update_curator_excel(
     curator: str,
     fio: str,
@@ -32,90 +210,11 @@ def create_or_update_curator_excel(
     Создает или обновляет Excel файл куратора с новым участником
     """
     try:
-        excel_path = get_curator_excel_path(curator)
-        
-        # Проверяем, существует ли файл
-        if excel_path.exists():
-            wb = load_workbook(excel_path)
-            ws = wb.active
-            # Находим последнюю заполненную строку
-            last_row = ws.max_row
-            next_row = last_row + 1
-        else:
-            # Создаем новый файл
-            wb = Workbook()
-            ws = wb.active
-            ws.title = curator
-            
-            # Создаем заголовки (без колонны "Путь")
-            headers = ["№", "Общий №", "ФИО", "Аптека", "Номер аптеки", "Должность", "ИНН", "Телефон", "Дата регистрации"]
-            
-            # Стили для заголовков
-            header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=11)
-            header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            
-            thin_border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            
-            for col_num, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col_num)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = header_alignment
-                cell.border = thin_border
-            
-            # Устанавливаем ширину колонок
-            ws.column_dimensions['A'].width = 6
-            ws.column_dimensions['B'].width = 10
-            ws.column_dimensions['C'].width = 25
-            ws.column_dimensions['D'].width = 25
-            ws.column_dimensions['E'].width = 12
-            ws.column_dimensions['F'].width = 15
-            ws.column_dimensions['G'].width = 15
-            ws.column_dimensions['H'].width = 15
-            ws.column_dimensions['I'].width = 20
-            
-            next_row = 2
-        
-        # Добавляем новую строку с данными
-        data_alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
+        row_data = build_curator_row(
+            fio, inn, phone, curator_number, total_number,
+            pharmacy_name, pharmacy_number, position
         )
-        
-        row_data = [
-            curator_number,                          # №
-            total_number,                            # Общий №
-            fio,                                     # ФИО
-            pharmacy_name or "",                     # Аптека
-            pharmacy_number or "",                   # Номер аптеки
-            position or "",                          # Должность
-            inn,                                     # ИНН
-            phone,                                   # Телефон
-            datetime.now().strftime("%d.%m.%Y %H:%M"),  # Дата регистрации
-        ]
-        
-        for col_num, value in enumerate(row_data, 1):
-            cell = ws.cell(row=next_row, column=col_num)
-            cell.value = value
-            cell.alignment = data_alignment
-            cell.border = thin_border
-            
-            # Выравнивание для чисел
-            if col_num in [1, 2]:
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Сохраняем файл
-        wb.save(excel_path)
+        append_rows_to_curator_excel(curator, [row_data])
         return True
     except Exception as e:
         print(f"Ошибка при работе с Excel: {e}")
@@ -123,18 +222,29 @@ def create_or_update_curator_excel(
 
 
 def get_all_curators_excel_stats() -> dict:
-    """Получает статистику по всем куратором из их Excel файлов"""
+    """
+    Получает статистику по всем куратором из их Excel файлов.
+    Живые счетчики без чтения файлов - utils/stats.py (stats_service)
+    """
     stats = {}
     
     for curator in CURATORS:
         excel_path = get_curator_excel_path(curator)
         if excel_path.exists():
             try:
-                wb = load_workbook(excel_path)
+                # В режиме read_only число строк берется из размеров листа,
+                # ячейки не разбираются
+                wb = load_workbook(excel_path, read_only=True)
                 ws = wb.active
+                if ws.max_row is None:
+                    # Размеры в файле не записаны - считаем строки
+                    ws.reset_dimensions()
+                    max_row = sum(1 for _ in ws.iter_rows(values_only=True))
+                else:
+                    max_row = ws.max_row
+                wb.close()
                 # Количество строк минус заголовок
-                count = ws.max_row - 1
-                stats[curator] = count
+                stats[curator] = max(max_row - 1, 0)
             except:
                 stats[curator] = 0
         else:
@@ -158,92 +268,11 @@ def create_or_update_general_excel(
     Создает или обновляет общий Excel файл со всеми участниками
     """
     try:
-        general_excel_path = Path(DATA_PATH) / "Все_участники.xlsx"
-        
-        # Проверяем, существует ли файл
-        if general_excel_path.exists():
-            wb = load_workbook(general_excel_path)
-            ws = wb.active
-            # Находим последнюю заполненную строку
-            last_row = ws.max_row
-            next_row = last_row + 1
-        else:
-            # Создаем новый файл
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Участники"
-            
-            # Создаем заголовки
-            headers = ["Общий №", "№ у куратора", "ФИО", "Аптека", "Номер аптеки", "Должность", "ИНН", "Телефон", "Куратор", "Дата регистрации"]
-            
-            # Стили для заголовков
-            header_fill = PatternFill(start_color="2F5496", end_color="2F5496", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=11)
-            header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            
-            thin_border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            
-            for col_num, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col_num)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = header_alignment
-                cell.border = thin_border
-            
-            # Устанавливаем ширину колонок
-            ws.column_dimensions['A'].width = 12
-            ws.column_dimensions['B'].width = 12
-            ws.column_dimensions['C'].width = 25
-            ws.column_dimensions['D'].width = 25
-            ws.column_dimensions['E'].width = 12
-            ws.column_dimensions['F'].width = 15
-            ws.column_dimensions['G'].width = 15
-            ws.column_dimensions['H'].width = 15
-            ws.column_dimensions['I'].width = 15
-            ws.column_dimensions['J'].width = 20
-            
-            next_row = 2
-        
-        # Добавляем новую строку с данными
-        data_alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
+        row_data = build_general_row(
+            fio, inn, phone, curator, total_number, curator_number,
+            pharmacy_name, pharmacy_number, position
         )
-        
-        row_data = [
-            total_number,                            # Общий №
-            curator_number,                          # № у куратора
-            fio,                                     # ФИО
-            pharmacy_name or "",                     # Аптека
-            pharmacy_number or "",                   # Номер аптеки
-            position or "",                          # Должность
-            inn,                                     # ИНН
-            phone,                                   # Телефон
-            curator,                                 # Куратор
-            datetime.now().strftime("%d.%m.%Y %H:%M"),  # Дата регистрации
-        ]
-        
-        for col_num, value in enumerate(row_data, 1):
-            cell = ws.cell(row=next_row, column=col_num)
-            cell.value = value
-            cell.alignment = data_alignment
-            cell.border = thin_border
-            
-            # Выравнивание для чисел
-            if col_num in [1, 2]:
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Сохраняем файл
-        wb.save(general_excel_path)
+        append_rows_to_general_excel([row_data])
         return True
     except Exception as e:
         print(f"Ошибка при работе с общим Excel: {e}")
@@ -0,0 +1,202 @@
+"""
+Фоновый экспорт участников из базы в Excel файлы
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from config.settings import CURATORS, EXCEL_FLUSH_BATCH_SIZE, EXCEL_FLUSH_INTERVAL
+from utils.excel_manager import (
+    build_curator_row,
+    build_general_row,
+    append_rows_to_curator_excel,
+    append_rows_to_general_excel,
+    get_curator_excel_path,
+    get_general_excel_path
+)
+from utils.storage import RegistrationStore, store, parse_registered_at
+from utils.executor import storage_executor, db_executor
+from utils.locks import file_lock
+from utils.metrics import EXCEL_EXPORT
+
+logger = logging.getLogger(__name__)
+
+GENERAL_WATERMARK_KEY = "excel_exported_id:general"
+CURATOR_WATERMARK_KEY = "excel_exported_id:{curator}"
+
+
+class ExcelWriter:
+    """
+    Дописывает в Excel участников, появившихся в базе после последнего экспорта.
+    Экспорт запускается пачками в пуле storage_executor: при накоплении
+    batch_size регистраций, по таймеру, перед /getfile и при остановке бота.
+    Одна перезапись файла покрывает сразу много регистраций. Для каждого файла в базе хранится id
+    последней выгруженной записи; если файл удален, он строится заново.
+    """
+
+    def __init__(
+        self,
+        registration_store: RegistrationStore = store,
+        batch_size: int = EXCEL_FLUSH_BATCH_SIZE,
+        flush_interval: float = EXCEL_FLUSH_INTERVAL
+    ):
+        self.store = registration_store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = 0
+        # Создаются в работающем цикле событий (start, flush): excel_writer
+        # создается при импорте, а в Python 3.9 Lock и Event запоминают цикл
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def pending(self) -> int:
+        """Количество регистраций, еще не выгруженных в Excel"""
+        return self._pending
+
+    def notify(self):
+        """Сообщает о новой записи в базе"""
+        self._pending += 1
+        if self._pending >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def mark_all_exported(self):
+        """Отмечает все записи базы как уже выгруженные в Excel"""
+        last_id = self.store.get_last_id()
+        self.store.set_meta(GENERAL_WATERMARK_KEY, last_id)
+        for curator in CURATORS:
+            self.store.set_meta(CURATOR_WATERMARK_KEY.format(curator=curator), last_id)
+
+    def _get_watermark(self, key: str, excel_path) -> int:
+        """id последней выгруженной записи (0, если файла нет)"""
+        if not excel_path.exists():
+            return 0
+        return int(self.store.get_meta(key, "0"))
+
+    def export_general(self, up_to: Optional[int] = None) -> int:
+        """
+        Синхронно дописывает новые записи базы (до up_to включительно) в общий Excel.
+        Возвращает количество добавленных строк
+        """
+        excel_path = get_general_excel_path()
+        # Другой процесс бота может писать этот же файл
+        with file_lock(excel_path):
+            participants = self.store.get_participants_since(
+                self._get_watermark(GENERAL_WATERMARK_KEY, excel_path),
+                up_to=up_to
+            )
+            if not participants:
+                return 0
+            
+            with EXCEL_EXPORT.time(workbook="general"):
+                append_rows_to_general_excel([
+                    build_general_row(
+                        p["fio"], p["inn"], p["phone"], p["curator"],
+                        p["total_number"], p["curator_number"],
+                        p["pharmacy_name"], p["pharmacy_number"], p["position"],
+                        parse_registered_at(p["registered_at"])
+                    )
+                    for p in participants
+                ])
+            self.store.set_meta(GENERAL_WATERMARK_KEY, participants[-1]["id"])
+        logger.info(f"Общий Excel: записано строк {len(participants)}")
+        return len(participants)
+
+    def export_curator(self, curator: str, up_to: Optional[int] = None) -> int:
+        """
+        Синхронно дописывает новые записи базы (до up_to включительно) в Excel куратора.
+        Возвращает количество добавленных строк
+        """
+        curator_key = CURATOR_WATERMARK_KEY.format(curator=curator)
+        excel_path = get_curator_excel_path(curator)
+        with file_lock(excel_path):
+            participants = self.store.get_participants_since(
+                self._get_watermark(curator_key, excel_path),
+                curator=curator,
+                up_to=up_to
+            )
+            if not participants:
+                return 0
+            
+            with EXCEL_EXPORT.time(workbook=curator):
+                append_rows_to_curator_excel(curator, [
+                    build_curator_row(
+                        p["fio"], p["inn"], p["phone"],
+                        p["curator_number"], p["total_number"],
+                        p["pharmacy_name"], p["pharmacy_number"], p["position"],
+                        parse_registered_at(p["registered_at"])
+                    )
+                    for p in participants
+                ])
+            self.store.set_meta(curator_key, participants[-1]["id"])
+        logger.info(f"Excel куратора {curator}: записано строк {len(participants)}")
+        return len(participants)
+
+    async def flush(self, up_to: Optional[int] = None):
+        """
+        Выгружает в Excel новые записи базы.
+        up_to - только до этого id включительно (остальные выгрузит следующий сброс)
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            pending, self._pending = self._pending, 0
+            
+            # Каждый файл пишется в пуле своей очередью, разные файлы - параллельно
+            jobs = [storage_executor.run(str(get_general_excel_path()), self.export_general, up_to)]
+            jobs += [
+                storage_executor.run(
+                    str(get_curator_excel_path(curator)), self.export_curator, curator, up_to
+                )
+                for curator in CURATORS
+            ]
+            results = await asyncio.gather(*jobs, return_exceptions=True)
+            
+            errors = [r for r in results if isinstance(r, Exception)]
+            for error in errors:
+                logger.error(f"Ошибка при выгрузке в Excel: {error}")
+            if errors:
+                # Записи остались в базе, повторим при следующем сбросе
+                self._pending += pending
+
+    async def _run(self):
+        """Фоновый цикл выгрузки по размеру пачки или по таймеру"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            had_pending = self._pending > 0
+            await self.flush()
+            if had_pending:
+                logger.info(
+                    f"Пул операций с файлами: {storage_executor.stats()}, "
+                    f"с базой: {db_executor.stats()}"
+                )
+
+    def start(self):
+        """Запускает фоновую выгрузку"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую выгрузку и выгружает остаток"""
+        if self._task is not None:
+            # Даем текущей записи завершиться, а не прерываем ее на середине
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except Exception as e:
+                # Записи остались в базе - выгрузим их ниже
+                logger.error(f"Фоновая выгрузка в Excel завершилась с ошибкой: {e}")
+            self._task = None
+        await self.flush()
+
+
+excel_writer = ExcelWriter()
@@ -0,0 +1,166 @@
+"""
+Выполнение блокирующих операций с файлами вне цикла событий
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config.settings import STORAGE_MAX_WORKERS, STORAGE_MAX_QUEUE, DB_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних операций учитывать в статистике задержек
+LATENCY_WINDOW = 500
+
+
+def _percentile(values: list, percent: float) -> float:
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+class StorageExecutor:
+    """
+    Запускает синхронные функции (файлы, openpyxl, SQLite) в ограниченном
+    пуле потоков, чтобы они не блокировали обработку апдейтов.
+
+    Операции с одинаковым ключом (обычно путь к файлу) выполняются строго
+    в порядке вызова, с разными ключами - параллельно. Число операций,
+    ожидающих пула, ограничено max_queue: при переполнении вызывающий
+    ждет освобождения места.
+
+    Операции разной длительности держат в разных экземплярах: короткие
+    запросы SQLite (db_executor) не ждут за выгрузкой Excel и сборкой
+    архивов (storage_executor)
+    """
+
+    def __init__(
+        self,
+        max_workers: int = STORAGE_MAX_WORKERS,
+        max_queue: int = STORAGE_MAX_QUEUE,
+        thread_name_prefix: str = "storage"
+    ):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.max_queue = max_queue
+        self._pool: Optional[ThreadPoolExecutor] = None
+        # Семафор создается при первом run(): пулы создаются при импорте,
+        # а в Python 3.9 семафор привязан к циклу, текущему при создании
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tails: Dict[str, asyncio.Future] = {}
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_times: deque = deque(maxlen=LATENCY_WINDOW)
+        self._run_times: deque = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        """Пул потоков (создается при первом обращении)"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=self.thread_name_prefix
+            )
+        return self._pool
+
+    @property
+    def queue_depth(self) -> int:
+        """Операции, которые ждут своей очереди или свободного потока"""
+        return self._queued
+
+    def _execute(self, func: Callable, args: tuple, kwargs: dict, submitted_at: float) -> Any:
+        """Выполняется в потоке пула"""
+        started_at = time.perf_counter()
+        self._wait_times.append(started_at - submitted_at)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._run_times.append(time.perf_counter() - started_at)
+
+    async def run(self, key: Optional[str], func: Callable, *args, **kwargs) -> Any:
+        """
+        Выполняет func(*args, **kwargs) в пуле потоков и возвращает результат.
+        key - ключ упорядочивания (None - без упорядочивания)
+        """
+        loop = asyncio.get_running_loop()
+        submitted_at = time.perf_counter()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_queue)
+
+        previous = self._tails.get(key) if key is not None else None
+        done = loop.create_future()
+        if key is not None:
+            self._tails[key] = done
+
+        def release(_=None):
+            if not done.done():
+                done.set_result(None)
+            if key is not None and self._tails.get(key) is done:
+                del self._tails[key]
+
+        self._queued += 1
+        waiting = True
+        try:
+            # Ждем завершения предыдущей операции с тем же ключом
+            if previous is not None:
+                await asyncio.shield(previous)
+
+            async with self._slots:
+                waiting = False
+                self._queued -= 1
+                self._running += 1
+                future = loop.run_in_executor(
+                    self.pool, self._execute, func, args, kwargs, submitted_at
+                )
+                # Следующая операция с этим ключом стартует только после
+                # фактического завершения потока, даже если нас отменили
+                future.add_done_callback(release)
+                try:
+                    result = await asyncio.shield(future)
+                    self._completed += 1
+                    return result
+                except Exception:
+                    self._failed += 1
+                    raise
+                finally:
+                    self._running -= 1
+        finally:
+            if waiting:
+                self._queued -= 1
+                # Отменили до запуска: очередь по ключу продолжится после предыдущей операции
+                if previous is not None and not previous.done():
+                    previous.add_done_callback(release)
+                else:
+                    release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и задержки операций (в секундах)"""
+        wait_times = sorted(self._wait_times)
+        run_times = sorted(self._run_times)
+        return {
+            "queue_depth": self._queued,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "wait_p50": _percentile(wait_times, 50),
+            "wait_p95": _percentile(wait_times, 95),
+            "run_p50": _percentile(run_times, 50),
+            "run_p95": _percentile(run_times, 95),
+        }
+
+    def shutdown(self):
+        """Дожидается завершения начатых операций и останавливает пул"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+storage_executor = StorageExecutor()
+db_executor = StorageExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
@@ -0,0 +1,354 @@
+"""
+Выгрузка данных регистрации в ZIP архив
+"""
+import json
+import os
+import shutil
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import DATA_PATH, EXPORT_VOLUME_MAX_BYTES, EXPORT_CACHE_PATH
+from utils.excel_manager import build_general_row, append_rows_to_general_excel
+from utils.storage import RegistrationStore, store, parse_registered_at
+
+# Уже сжатые форматы кладем в архив как есть - повторное сжатие их не уменьшит
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+# Папка внутри архива
+ARCHIVE_ROOT = "data"
+
+# Описание выгрузки в корне архива
+MANIFEST_NAME = "manifest.json"
+
+# Какие участники в какой части архива (кладется в первую часть)
+INDEX_NAME = "index.json"
+
+# Примерный размер служебных записей ZIP на один файл, байт
+ZIP_ENTRY_OVERHEAD = 128
+
+# Таблица участников, попавших в частичную выгрузку
+DELTA_EXCEL_NAME = "Новые_участники.xlsx"
+
+# Служебные значения в базе: id последнего выгруженного участника и номер выгрузки
+EXPORT_WATERMARK_KEY = "export_watermark"
+EXPORT_SEQ_KEY = "export_seq"
+
+# Описание закэшированного архива
+EXPORT_CACHE_FILE = "cache.json"
+
+# Файл на диске -> путь внутри архива
+ArchiveEntry = Tuple[Path, str]
+
+
+class ExportProgress:
+    """Счетчик обработанных файлов (пишется из потока пула, читается из цикла событий)"""
+
+    def __init__(self):
+        self.done = 0
+        self.total = 0
+        self.volume = 1
+        self.volumes = 1
+
+
+def _list_files(root) -> List[Path]:
+    """Все файлы папки, кроме скрытых (временные .part файлы и т.п.)"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        files.extend(
+            Path(dirpath) / filename
+            for filename in sorted(filenames)
+            if not filename.startswith(".")
+        )
+    return files
+
+
+def list_data_files(root: str = DATA_PATH) -> List[Path]:
+    """Все файлы папки данных"""
+    return _list_files(root)
+
+
+def get_compress_type(path: Path) -> int:
+    """Способ сжатия для файла: фото без сжатия, остальное - deflate"""
+    if path.suffix.lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def get_arcname(path: Path, root: str = DATA_PATH) -> str:
+    """Путь файла внутри архива"""
+    return str(Path(ARCHIVE_ROOT) / Path(path).relative_to(root))
+
+
+def collect_data_entries(root: str = DATA_PATH) -> List[ArchiveEntry]:
+    """Файлы полной выгрузки: вся папка данных"""
+    return [(path, get_arcname(path, root)) for path in list_data_files(root)]
+
+
+def build_archive(
+    archive_path: Path,
+    entries: List[ArchiveEntry],
+    progress: Optional[ExportProgress] = None,
+    manifest: Optional[Dict[str, Any]] = None,
+    index: Optional[Dict[str, Any]] = None
+) -> int:
+    """
+    Записывает файлы прямо в ZIP архив, без промежуточной копии.
+    entries - список (файл, путь в архиве).
+    Выполняется синхронно (в пуле потоков). Возвращает число файлов в архиве
+    """
+    with zipfile.ZipFile(archive_path, "w", allowZip64=True) as zf:
+        for path, arcname in entries:
+            zf.write(path, arcname=arcname, compress_type=get_compress_type(path))
+            if progress is not None:
+                progress.done += 1
+        for name, content in ((MANIFEST_NAME, manifest), (INDEX_NAME, index)):
+            if content is not None:
+                zf.writestr(
+                    name,
+                    json.dumps(content, ensure_ascii=False, indent=2),
+                    compress_type=zipfile.ZIP_DEFLATED
+                )
+
+    return len(entries)
+
+
+def _get_unit_key(arcname: str) -> str:
+    """
+    Папка участника (data/<куратор>/<ФИО>) для файла внутри архива.
+    Файлы участника не разносятся по разным частям архива
+    """
+    parts = Path(arcname).parts
+    if len(parts) > 3:
+        return str(Path(*parts[:3]))
+    return arcname
+
+
+def plan_volumes(
+    entries: List[ArchiveEntry],
+    max_bytes: int = EXPORT_VOLUME_MAX_BYTES
+) -> List[List[ArchiveEntry]]:
+    """
+    Раскладывает файлы по частям архива так, чтобы каждая часть была не
+    больше max_bytes. Размер оценивается по несжатому размеру файлов, то
+    есть с запасом. Участник, который один не влезает в часть, получает
+    отдельную часть
+    """
+    units: Dict[str, List[ArchiveEntry]] = {}
+    for entry in entries:
+        units.setdefault(_get_unit_key(entry[1]), []).append(entry)
+
+    volumes: List[List[ArchiveEntry]] = []
+    current: List[ArchiveEntry] = []
+    current_size = 0
+    for unit_entries in units.values():
+        unit_size = sum(
+            os.path.getsize(path) + ZIP_ENTRY_OVERHEAD + 2 * len(arcname.encode())
+            for path, arcname in unit_entries
+        )
+        if current and current_size + unit_size > max_bytes:
+            volumes.append(current)
+            current, current_size = [], 0
+        current.extend(unit_entries)
+        current_size += unit_size
+    if current or not volumes:
+        volumes.append(current)
+    return volumes
+
+
+def build_volume_index(
+    volumes: List[List[ArchiveEntry]],
+    manifest: Dict[str, Any],
+    filenames: List[str]
+) -> Dict[str, Any]:
+    """Оглавление: какие участники в какой части архива"""
+    participants_by_folder = {
+        p["folder"]: p for p in manifest.get("participants", []) if p.get("folder")
+    }
+    index = {"volumes": []}
+    for number, (volume_entries, filename) in enumerate(zip(volumes, filenames), 1):
+        folders = sorted({
+            _get_unit_key(arcname) for _, arcname in volume_entries
+            if len(Path(arcname).parts) > 3
+        })
+        index["volumes"].append({
+            "volume": number,
+            "filename": filename,
+            "files": len(volume_entries),
+            "participants": [
+                participants_by_folder.get(folder, {"folder": folder})
+                for folder in folders
+            ],
+        })
+    return index
+
+
+def build_manifest(
+    kind: str,
+    participants: List[Dict[str, Any]],
+    seq: Optional[int] = None,
+    from_id: int = 0,
+    to_id: int = 0,
+    since: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """
+    Описание выгрузки. Выгрузки full и delta нумеруются по порядку (seq):
+    полная выгрузка и все следующие за ней delta, распакованные по
+    порядку поверх друг друга, дают полный набор данных. Строки таблиц
+    из delta дописываются к общему Excel файлу
+    """
+    manifest = {
+        "type": kind,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "from_id": from_id,
+        "to_id": to_id,
+        "participants": [
+            {
+                "id": p["id"],
+                "total_number": p["total_number"],
+                "curator_number": p["curator_number"],
+                "curator": p["curator"],
+                "fio": p["fio"],
+                "folder": get_arcname(p["folder"]) if p.get("folder") else None,
+            }
+            for p in participants
+        ],
+    }
+    if seq is not None:
+        manifest["seq"] = seq
+        manifest["previous_seq"] = seq - 1 if seq > 1 else None
+    if since is not None:
+        manifest["since"] = since.strftime("%Y-%m-%d %H:%M:%S")
+    return manifest
+
+
+def collect_participant_entries(
+    participants: List[Dict[str, Any]],
+    work_dir: Path
+) -> List[ArchiveEntry]:
+    """
+    Файлы частичной выгрузки: папки участников и таблица с их строками.
+    Таблица создается в work_dir
+    """
+    entries: List[ArchiveEntry] = []
+    # Участники с одинаковым ФИО у одного куратора делят папку - кладем ее один раз
+    seen_folders = set()
+    for p in participants:
+        folder = p.get("folder")
+        if not folder or folder in seen_folders or not Path(folder).is_dir():
+            continue
+        seen_folders.add(folder)
+        entries.extend((path, get_arcname(path)) for path in _list_files(folder))
+
+    delta_excel_path = Path(work_dir) / DELTA_EXCEL_NAME
+    append_rows_to_general_excel(
+        [
+            build_general_row(
+                p["fio"], p["inn"], p["phone"], p["curator"],
+                p["total_number"], p["curator_number"],
+                p["pharmacy_name"], p["pharmacy_number"], p["position"],
+                parse_registered_at(p["registered_at"])
+            )
+            for p in participants
+        ],
+        excel_path=delta_excel_path
+    )
+    entries.append((delta_excel_path, str(Path(ARCHIVE_ROOT) / DELTA_EXCEL_NAME)))
+    return entries
+
+
+def prepare_full_export(registration_store: RegistrationStore = store) -> Dict[str, Any]:
+    """
+    Описание полной выгрузки (вся папка данных): участники до to_id -
+    последней записи базы на момент вызова
+    """
+    seq = int(registration_store.get_meta(EXPORT_SEQ_KEY, "0")) + 1
+    participants = registration_store.get_participants_since(0)
+    to_id = participants[-1]["id"] if participants else 0
+    return build_manifest("full", participants, seq=seq, to_id=to_id)
+
+
+def prepare_delta_export(
+    work_dir: Path,
+    registration_store: RegistrationStore = store
+) -> Tuple[List[ArchiveEntry], Dict[str, Any]]:
+    """
+    Частичная выгрузка участников, добавленных после прошлой выгрузки.
+    Если новых участников нет, список файлов пустой
+    """
+    from_id = int(registration_store.get_meta(EXPORT_WATERMARK_KEY, "0"))
+    seq = int(registration_store.get_meta(EXPORT_SEQ_KEY, "0")) + 1
+    participants = registration_store.get_participants_since(from_id)
+    if not participants:
+        return [], build_manifest("delta", [], seq=seq, from_id=from_id, to_id=from_id)
+
+    manifest = build_manifest(
+        "delta", participants, seq=seq,
+        from_id=from_id, to_id=participants[-1]["id"]
+    )
+    return collect_participant_entries(participants, work_dir), manifest
+
+
+def prepare_since_export(
+    since: datetime,
+    work_dir: Path,
+    registration_store: RegistrationStore = store
+) -> Tuple[List[ArchiveEntry], Dict[str, Any]]:
+    """
+    Выгрузка участников, зарегистрированных начиная с даты since.
+    Разовая: не сдвигает отметку последней выгрузки
+    """
+    participants = registration_store.get_participants_registered_since(since)
+    manifest = build_manifest(
+        "since", participants,
+        to_id=participants[-1]["id"] if participants else 0,
+        since=since
+    )
+    if not participants:
+        return [], manifest
+    return collect_participant_entries(participants, work_dir), manifest
+
+
+def commit_export(manifest: Dict[str, Any], registration_store: RegistrationStore = store):
+    """Запоминает отправленную выгрузку: следующая delta начнется после нее"""
+    if manifest.get("seq") is None:
+        return
+    registration_store.set_meta(EXPORT_WATERMARK_KEY, manifest["to_id"])
+    registration_store.set_meta(EXPORT_SEQ_KEY, manifest["seq"])
+
+
+def load_export_cache(cache_path: str = EXPORT_CACHE_PATH) -> Optional[Dict[str, Any]]:
+    """
+    Описание последнего полного архива: поколение данных и части архива
+    (имя файла, file_id в Telegram, подпись, путь на диске)
+    """
+    cache_file = Path(cache_path) / EXPORT_CACHE_FILE
+    if not cache_file.exists():
+        return None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def prepare_export_cache_dir(cache_path: str = EXPORT_CACHE_PATH) -> Path:
+    """Очищает папку кэша перед сборкой нового архива"""
+    shutil.rmtree(cache_path, ignore_errors=True)
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+    return Path(cache_path)
+
+
+def save_export_cache(
+    generation: int,
+    volumes: List[Dict[str, Any]],
+    cache_path: str = EXPORT_CACHE_PATH
+):
+    """Сохраняет описание отправленного полного архива"""
+    cache_file = Path(cache_path) / EXPORT_CACHE_FILE
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({"generation": generation, "volumes": volumes}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, cache_file)
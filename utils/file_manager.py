@@ -3,6 +3,7 @@
 """
 import os
 import json
+import tempfile
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any
@@ -20,59 +21,59 @@ def ensure_directories_exist():
 
 
 def load_counters() -> Dict[str, int]:
-    """Загружает счетчики участников"""
-    ensure_directories_exist()
+    """Загружает снимок счетчиков участников"""
+    counters = {
+        "total": 0,
+    }
+    for curator in CURATORS:
+        counters[curator] = 0
     
     if os.path.exists(COUNTERS_FILE):
         try:
             with open(COUNTERS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                counters.update(json.load(f))
         except:
             pass
     
-    # Инициализируем счетчики
-    counters = {
-        "total": 0,
-    }
-    for curator in CURATORS:
-        counters[curator] = 0
-    
-    save_counters(counters)
     return counters
 
 
 def save_counters(counters: Dict[str, int]):
-    """Сохраняет счетчики участников"""
+    """Атомарно сохраняет снимок счетчиков участников"""
     os.makedirs(os.path.dirname(COUNTERS_FILE), exist_ok=True)
     
-    with open(COUNTERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(counters, f, ensure_ascii=False, indent=2)
-
-
-def increment_counters(curator: str) -> tuple[int, int]:
-    """
-    Увеличивает счетчики
-    Возвращает: (общий номер, номер куратора)
-    """
-    counters = load_counters()
-    
-    counters["total"] += 1
-    counters[curator] += 1
-    
-    save_counters(counters)
-    
-    return counters["total"], counters[curator]
+    # Пишем во временный файл и подменяем им старый, чтобы при сбое
+    # на диске не остался наполовину записанный JSON. Имя временного
+    # файла уникальное - процессы бота не мешают друг другу
+    fd, tmp_file = tempfile.mkstemp(
+        prefix=".counters.", suffix=".tmp", dir=os.path.dirname(COUNTERS_FILE)
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(counters, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, COUNTERS_FILE)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
 
 
-def create_user_folder(curator: str, fio: str) -> Path:
-    """Создает папку для пользователя"""
+def get_user_folder(curator: str, fio: str) -> Path:
+    """Возвращает путь к папке пользователя (без создания)"""
     curator_path = Path(DATA_PATH) / curator
     
     # Замена недопустимых символов в имени папки
     safe_fio = "".join(c if c.isalnum() or c in "-_ кириллица" else "_" 
                        for c in fio).replace(" ", "_")
     
-    user_path = curator_path / safe_fio
+    return curator_path / safe_fio
+
+
+def create_user_folder(curator: str, fio: str) -> Path:
+    """Создает папку для пользователя"""
+    user_path = get_user_folder(curator, fio)
     user_path.mkdir(parents=True, exist_ok=True)
     
     return user_path
@@ -103,9 +104,3 @@ def save_user_info(
     
     with open(info_file, 'w', encoding='utf-8') as f:
         f.write(content)
-
-
-def get_user_number(curator: str) -> int:
-    """Получает текущий номер пользователя для куратора"""
-    counters = load_counters()
-    return counters.get(curator, 0)
@@ -0,0 +1,302 @@
+"""
+Хранилище состояний FSM на SQLite: незавершенные регистрации
+переживают перезапуск бота
+"""
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config.settings import FSM_DB_FILE, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, WORKERS
+from utils.executor import db_executor
+from utils.storage import BUSY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key        TEXT PRIMARY KEY,
+    state      TEXT,
+    data       TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at);
+"""
+
+
+class FSMRecord:
+    """Состояние и данные одного пользователя"""
+
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+    @property
+    def empty(self) -> bool:
+        """Пользователь не в процессе регистрации - хранить нечего"""
+        return self.state is None and not self.data
+
+
+def make_key(key: StorageKey) -> str:
+    """Строковый ключ записи в базе"""
+    thread_id = key.thread_id if key.thread_id is not None else ""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM для aiogram. Чтение идет из LRU кэша в памяти (до
+    cache_size пользователей), в базу обращаемся только при промахе.
+    Изменения сразу видны в кэше, а в базу пишутся пачкой одной
+    транзакцией раз в flush_interval секунд и при остановке бота.
+    Пустые записи (нет ни состояния, ни данных) удаляются из базы.
+
+    Если бот запущен несколькими процессами, апдейты одного пользователя
+    могут попасть в разные процессы. Тогда кэш отключается (cache_size=0),
+    а изменения пишутся в базу сразу (flush_interval=0).
+    """
+
+    def __init__(
+        self,
+        db_path: str = FSM_DB_FILE,
+        cache_size: int = FSM_CACHE_SIZE,
+        flush_interval: float = FSM_FLUSH_INTERVAL
+    ):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, FSMRecord]" = OrderedDict()
+        # Изменения, еще не записанные в базу, и пачка, которая пишется сейчас
+        self._dirty: Dict[str, FSMRecord] = {}
+        self._flushing: Dict[str, FSMRecord] = {}
+        # Примитивы asyncio создаются внутри работающего цикла событий: до
+        # Python 3.10 они привязываются к циклу, текущему при создании, а
+        # хранилище создается при импорте модуля
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Открывает соединение при первом обращении"""
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _read(self, key: str) -> FSMRecord:
+        """Читает запись из базы (в пуле потоков)"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return FSMRecord()
+        return FSMRecord(row[0], json.loads(row[1]), row[2])
+
+    def _write(self, records: List[Tuple[str, FSMRecord]]):
+        """Записывает пачку изменений одной транзакцией (в пуле потоков)"""
+        with self._lock, self.conn:
+            for key, record in records:
+                if record.empty:
+                    self.conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+                else:
+                    self.conn.execute(
+                        "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                        "data = excluded.data, updated_at = excluded.updated_at",
+                        (key, record.state, json.dumps(record.data, ensure_ascii=False),
+                         record.updated_at)
+                    )
+
+    def _remember(self, key: str, record: FSMRecord):
+        """Кладет запись в кэш и вытесняет самые давние"""
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _get_record(self, key: str) -> FSMRecord:
+        """Запись пользователя: из кэша, из несохраненных изменений или из базы"""
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            return record
+
+        record = self._dirty.get(key) or self._flushing.get(key)
+        if record is None:
+            record = await db_executor.run(self.db_path, self._read, key)
+            # Пока читали, запись могли изменить
+            if key in self._cache:
+                return self._cache[key]
+        self._remember(key, record)
+        return record
+
+    def _mark_dirty(self, key: str, record: FSMRecord):
+        """Запоминает изменение для следующего сброса на диск"""
+        record.updated_at = time.time()
+        self._remember(key, record)
+        self._dirty[key] = record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = make_key(key)
+        current = await self._get_record(storage_key)
+        new_state = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key, FSMRecord(new_state, current.data))
+        if not self.flush_interval:
+            await self.flush()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(make_key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = make_key(key)
+        current = await self._get_record(storage_key)
+        self._mark_dirty(storage_key, FSMRecord(current.state, copy.deepcopy(data)))
+        if not self.flush_interval:
+            await self.flush()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._get_record(make_key(key))).data)
+
+    async def flush(self):
+        """Записывает накопленные изменения в базу"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                await db_executor.run(
+                    self.db_path, self._write, list(self._flushing.items())
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при записи состояний FSM: {e}")
+                # Вернем в очередь то, что не перезаписали за время сброса
+                for key, record in self._flushing.items():
+                    self._dirty.setdefault(key, record)
+            finally:
+                self._flushing = {}
+
+    def _delete_idle(self, cutoff: float) -> List[str]:
+        """Удаляет из базы записи, не менявшиеся с cutoff (в пуле потоков)"""
+        # SELECT и DELETE в одной транзакции вместо DELETE ... RETURNING:
+        # RETURNING нет в SQLite до 3.35 (Ubuntu 20.04, Debian 11)
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                "SELECT key FROM fsm WHERE updated_at < ?", (cutoff,)
+            ).fetchall()
+            self.conn.execute("DELETE FROM fsm WHERE updated_at < ?", (cutoff,))
+        return [row[0] for row in rows]
+
+    async def expire_idle(self, max_idle: float) -> List[int]:
+        """
+        Удаляет сессии, не менявшиеся дольше max_idle секунд.
+        Возвращает id пользователей удаленных сессий
+        """
+        cutoff = time.time() - max_idle
+        # Сначала сохраняем свежие изменения, чтобы не удалить активные сессии
+        await self.flush()
+        keys = await db_executor.run(self.db_path, self._delete_idle, cutoff)
+
+        user_ids = []
+        for key in keys:
+            record = self._dirty.get(key) or self._cache.get(key)
+            if record is not None and record.updated_at >= cutoff:
+                # Пользователь вернулся, пока шло удаление - запись сохранится при сбросе
+                continue
+            self._cache.pop(key, None)
+            user_ids.append(int(key.split(":")[2]))
+        return user_ids
+
+    def _count_sessions(self) -> int:
+        """Количество записей в базе (в пуле потоков)"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+
+    def _count_by_state(self) -> Dict[Optional[str], int]:
+        """Количество записей в базе по состояниям (в пуле потоков)"""
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM fsm GROUP BY state").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    async def count_by_state(self) -> Dict[Optional[str], int]:
+        """Сколько пользователей в каждом состоянии FSM"""
+        await self.flush()
+        return await db_executor.run(self.db_path, self._count_by_state)
+
+    async def stats(self) -> Dict[str, Any]:
+        """Число живых сессий и примерный объем кэша в памяти (байт)"""
+        await self.flush()
+        sessions = await db_executor.run(self.db_path, self._count_sessions)
+        cache_bytes = sum(
+            len(key) + len(record.state or "") + len(json.dumps(record.data, ensure_ascii=False))
+            for key, record in self._cache.items()
+        )
+        return {
+            "sessions": sessions,
+            "cached": len(self._cache),
+            "cache_bytes": cache_bytes,
+        }
+
+    async def _run(self):
+        """Фоновый сброс изменений по таймеру"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Запускает фоновый сброс изменений"""
+        if self._task is None and self.flush_interval:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Сохраняет все изменения и закрывает базу"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except Exception as e:
+                # Изменения остались в памяти - сохраним их ниже
+                logger.error(f"Фоновый сброс состояний FSM завершился с ошибкой: {e}")
+            self._task = None
+        await self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+if WORKERS > 1:
+    fsm_storage = SQLiteStorage(cache_size=0, flush_interval=0)
+else:
+    fsm_storage = SQLiteStorage()
@@ -0,0 +1,38 @@
+"""
+Блокировки файлов между процессами (несколько экземпляров бота)
+"""
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: бот работает одним процессом, блокировка не нужна
+    fcntl = None
+
+
+def get_lock_path(path) -> Path:
+    """Файл блокировки рядом с защищаемым файлом (скрытый, в архив не попадает)"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.lock")
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Эксклюзивная блокировка файла path на время блока with.
+    Работает и между процессами, и между потоками одного процесса
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = get_lock_path(path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
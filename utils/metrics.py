@@ -0,0 +1,271 @@
+"""
+Метрики бота в текстовом формате Prometheus (эндпоинт /metrics)
+"""
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config.settings import METRICS_HOST
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    """Экранирование значения метки"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """{name="value",...} для строки метрики"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Число в формате Prometheus"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Общая часть метрик: имя, описание, метки"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        # Метрики обновляются и из потоков пула storage_executor
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Строки значений метрики для render"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Счетчик, который только растет"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        # Копия под блокировкой: словарь меняют потоки пула
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    """Текущее значение (может расти и уменьшаться)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def replace(self, values: Dict[LabelValues, float]):
+        """Заменяет все значения сразу (метки, которых больше нет, пропадают)"""
+        values = dict(values)
+        with self._lock:
+            self._values = values
+
+    def _samples(self) -> List[str]:
+        # Копия под блокировкой: словарь меняют потоки пула
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    """Распределение длительностей по корзинам"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # метки -> (счетчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Замеряет длительность блока with (в том числе завершившегося ошибкой)"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in sorted(values):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Все метрики процесса. Значения, которые дорого считать постоянно
+    (например, число сессий FSM), обновляются сборщиками прямо перед выдачей
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]):
+        """Асинхронная функция, обновляющая метрики перед выдачей"""
+        self._collectors.append(collector)
+
+    async def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                logger.error(f"Ошибка при сборе метрик: {e}")
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+HANDLER_LATENCY = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта обработчиком", ("handler",)
+))
+HANDLER_ERRORS = registry.register(Counter(
+    "bot_handler_errors_total", "Ошибки в обработчиках", ("handler",)
+))
+REGISTRATION_STAGE = registry.register(Histogram(
+    "bot_registration_stage_seconds", "Длительность этапов завершения регистрации", ("stage",)
+))
+EXCEL_EXPORT = registry.register(Histogram(
+    "bot_excel_export_seconds", "Время выгрузки новых строк в Excel файл", ("workbook",)
+))
+API_CALLS = registry.register(Counter(
+    "bot_api_calls_total", "Запросы к Bot API", ("method",)
+))
+API_ERRORS = registry.register(Counter(
+    "bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error")
+))
+API_LATENCY = registry.register(Histogram(
+    "bot_api_call_duration_seconds", "Время запроса к Bot API", ("method",)
+))
+FSM_SESSIONS = registry.register(Gauge(
+    "bot_fsm_sessions", "Незавершенные регистрации по состояниям FSM", ("state",)
+))
+THROTTLED_UPDATES = registry.register(Gauge(
+    "bot_throttled_updates", "Сообщения, отброшенные ограничением частоты", ("reason",)
+))
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Считает запросы к Bot API, их длительность и ошибки по методам"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        API_CALLS.inc(method=name)
+        started_at = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started_at, method=name)
+
+
+async def start_metrics_server(port: int, host: str = METRICS_HOST) -> web.AppRunner:
+    """Поднимает сервер с эндпоинтом /metrics. Остановка - runner.cleanup()"""
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=await registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    # Prometheus опрашивает эндпоинт постоянно - не засоряем лог
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,196 @@
+"""
+Очередь исходящих сообщений с учетом лимитов Telegram
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from config.settings import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_GROUP_BURST,
+    OUTBOUND_PRIVATE_RATE,
+    OUTBOUND_MAX_RETRIES,
+    OUTBOUND_DRAIN_TIMEOUT,
+    WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def pause(self, seconds: float):
+        """Запрещает отправку на seconds секунд (после ответа 429)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated_at = self._blocked_until
+
+    async def acquire(self, tokens: float = 1):
+        """Ждет, пока в ведре наберется tokens токенов, и забирает их"""
+        # Запрос больше емкости ведра ждет полного ведра и уводит его в минус
+        needed = min(tokens, self.capacity)
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill()
+            if self._tokens >= needed:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((needed - self._tokens) / self.rate)
+
+
+class OutboundScheduler:
+    """
+    Отправляет запросы к Bot API с ограничением частоты: общее ведро токенов
+    на весь бот и отдельное на каждый чат. Запросы в один чат выполняются
+    строго по очереди одной задачей-обработчиком, которая живет, пока
+    у чата есть работа.
+
+    submit() сразу возвращает Future с результатом запроса: его можно
+    дождаться или не ждать - ошибки в этом случае попадают в лог.
+    На ответ 429 чат ставится на паузу на retry_after секунд,
+    после чего запрос повторяется. Запросы, не отправленные к остановке
+    бота, пишутся в лог с описанием (label) - по нему их можно повторить
+    вручную.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        workers: int = WORKERS
+    ):
+        # Лимиты Telegram общие на бота: каждый процесс берет свою долю
+        self.share = 1 / workers
+        self.global_bucket = TokenBucket(global_rate * self.share, global_rate * self.share)
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[Tuple[Callable[[], Awaitable], asyncio.Future, int, str]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # У групп и каналов отрицательные id
+            if chat_id < 0:
+                bucket = TokenBucket(
+                    OUTBOUND_GROUP_RATE * self.share, max(1, OUTBOUND_GROUP_BURST * self.share)
+                )
+            else:
+                rate = OUTBOUND_PRIVATE_RATE * self.share
+                bucket = TokenBucket(rate, max(1, rate))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество запросов, ожидающих отправки"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Ошибка при отправке сообщения: {future.exception()}")
+
+    def submit(
+        self,
+        chat_id: int,
+        request: Callable[[], Awaitable[Any]],
+        cost: int = 1,
+        label: str = ""
+    ) -> asyncio.Future:
+        """
+        Ставит запрос в очередь чата.
+        request - функция без аргументов, возвращающая корутину запроса;
+        cost - сколько сообщений отправляет запрос (для альбома - число фото);
+        label - что отправляется (для лога, если запрос не уйдет до остановки)
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        self._queues.setdefault(chat_id, deque()).append((request, future, cost, label))
+
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return future
+
+    async def _drain(self, chat_id: int):
+        """Отправляет запросы одного чата по очереди"""
+        queue = self._queues[chat_id]
+        bucket = self._get_chat_bucket(chat_id)
+        try:
+            while queue:
+                request, future, cost, _ = queue[0]
+                if future.cancelled():
+                    queue.popleft()
+                    continue
+
+                for attempt in range(self.max_retries + 1):
+                    await bucket.acquire(cost)
+                    await self.global_bucket.acquire(cost)
+                    try:
+                        result = await request()
+                    except TelegramRetryAfter as e:
+                        if attempt == self.max_retries:
+                            if not future.done():
+                                future.set_exception(e)
+                            break
+                        logger.warning(f"Лимит Telegram для чата {chat_id}: пауза {e.retry_after} сек")
+                        bucket.pause(e.retry_after)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                        break
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                        break
+
+                queue.popleft()
+        finally:
+            del self._workers[chat_id]
+            if queue:
+                # Нас отменили посреди очереди (остановка бота)
+                for _, future, _, label in queue:
+                    if not future.done():
+                        logger.warning(f"Не отправлено в чат {chat_id}: {label or 'запрос без описания'}")
+                    future.cancel()
+            del self._queues[chat_id]
+
+    async def close(self, timeout: float = OUTBOUND_DRAIN_TIMEOUT):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает обработчики"""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            logger.warning(
+                f"Очередь отправки не разошлась за {timeout} сек: запросов {self.queue_depth}, "
+                f"чатов {len(pending)}"
+            )
+        # Каждый неотправленный запрос попадет в лог при отмене обработчика
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+outbound_scheduler = OutboundScheduler()
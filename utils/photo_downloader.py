@@ -0,0 +1,95 @@
+"""
+Скачивание фото участников из Telegram
+"""
+import asyncio
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from config.settings import (
+    PHOTO_DOWNLOAD_CONCURRENCY,
+    PHOTO_DOWNLOAD_RETRIES,
+    PHOTO_DOWNLOAD_BACKOFF,
+    PHOTO_DOWNLOAD_TIMEOUT,
+    PHOTO_DOWNLOAD_CHUNK_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Поле с file_id в данных FSM -> имя файла в папке участника
+PHOTO_FILES = {
+    'passport_front_file_id': "passport_front.jpg",
+    'passport_back_file_id': "passport_back.jpg",
+    'diploma_file_id': "diploma.jpg",
+}
+
+# Общий лимит одновременных скачиваний на весь бот
+_download_slots: Optional[asyncio.Semaphore] = None
+
+
+def _get_download_slots() -> asyncio.Semaphore:
+    """
+    Семафор скачиваний. Создается при первом скачивании внутри цикла
+    событий бота: в Python 3.9 семафор, созданный при импорте, привязан
+    к другому циклу
+    """
+    global _download_slots
+    if _download_slots is None:
+        _download_slots = asyncio.Semaphore(PHOTO_DOWNLOAD_CONCURRENCY)
+    return _download_slots
+
+
+def _is_transient(error: Exception) -> bool:
+    """Можно ли повторить скачивание после такой ошибки"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (
+        TelegramNetworkError,
+        TelegramServerError,
+        TelegramRetryAfter,
+        aiohttp.ClientError,
+        asyncio.TimeoutError
+    ))
+
+
+async def download_photo(bot: Bot, file_id: str, destination: Path) -> Path:
+    """
+    Скачивает фото по file_id потоком во временный файл рядом с destination
+    и атомарно переименовывает его. Временные ошибки повторяются с паузой
+    """
+    tmp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex[:8]}.part")
+    
+    for attempt in range(1, PHOTO_DOWNLOAD_RETRIES + 1):
+        try:
+            async with _get_download_slots():
+                file = await bot.get_file(file_id)
+                await bot.download_file(
+                    file.file_path,
+                    tmp_path,
+                    timeout=PHOTO_DOWNLOAD_TIMEOUT,
+                    chunk_size=PHOTO_DOWNLOAD_CHUNK_SIZE
+                )
+            os.replace(tmp_path, destination)
+            return destination
+        except Exception as e:
+            if attempt == PHOTO_DOWNLOAD_RETRIES or not _is_transient(e):
+                raise
+            
+            if isinstance(e, TelegramRetryAfter):
+                delay = e.retry_after
+            else:
+                delay = PHOTO_DOWNLOAD_BACKOFF * 2 ** (attempt - 1)
+            logger.warning(
+                f"Не удалось скачать {destination.name} (попытка {attempt}): {e}. "
+                f"Повтор через {delay} сек"
+            )
+            await asyncio.sleep(delay)
+        finally:
+            # Недокачанный файл не должен оставаться в папке участника
+            tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,129 @@
+"""
+Фоновое скачивание фото, пока пользователь еще заполняет анкету
+"""
+import asyncio
+import logging
+import shutil
+from pathlib import Path
+from typing import Dict, Tuple
+
+from aiogram import Bot
+
+from config.settings import STAGING_PATH
+from utils.executor import storage_executor
+from utils.photo_downloader import PHOTO_FILES, download_photo
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoPrefetcher:
+    """
+    Начинает скачивание фото сразу после его получения, в промежуточную
+    папку пользователя staging/<user_id>/. При подтверждении регистрации
+    готовые файлы просто переносятся в папку участника.
+
+    Для каждого поля хранится только последнее фото: новое фото того же
+    поля (редактирование) отменяет предыдущее скачивание.
+    """
+
+    def __init__(self, staging_path: str = STAGING_PATH):
+        self.staging_path = Path(staging_path)
+        self._jobs: Dict[int, Dict[str, Tuple[str, asyncio.Task]]] = {}
+        # Куда уже перенесено готовое фото: (file_id, destination) по полям
+        self._collected: Dict[int, Dict[str, Tuple[str, Path]]] = {}
+
+    @property
+    def active_users(self) -> int:
+        """Пользователи, для которых есть скачивания в памяти"""
+        return len(self._jobs)
+
+    def get_staging_dir(self, user_id: int) -> Path:
+        """Промежуточная папка пользователя"""
+        return self.staging_path / str(user_id)
+
+    async def _download(self, bot: Bot, user_id: int, field: str, file_id: str) -> Path:
+        """Скачивает фото в промежуточную папку"""
+        staging_dir = self.get_staging_dir(user_id)
+        await storage_executor.run(None, staging_dir.mkdir, parents=True, exist_ok=True)
+        path = await download_photo(bot, file_id, staging_dir / PHOTO_FILES[field])
+        logger.info(f"Фото {field} пользователя {user_id} скачано заранее")
+        return path
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        """Логирует ошибку фонового скачивания"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не удалось заранее скачать фото: {task.exception()}")
+
+    def start(self, bot: Bot, user_id: int, field: str, file_id: str):
+        """Запускает фоновое скачивание фото для поля field"""
+        jobs = self._jobs.setdefault(user_id, {})
+        existing = jobs.get(field)
+        if existing is not None:
+            if existing[0] == file_id:
+                return
+            existing[1].cancel()
+
+        task = asyncio.create_task(self._download(bot, user_id, field, file_id))
+        task.add_done_callback(self._log_failure)
+        jobs[field] = (file_id, task)
+
+    async def collect(self, user_id: int, field: str, file_id: str, destination: Path) -> bool:
+        """
+        Дожидается фонового скачивания и переносит файл в destination.
+        Возвращает False, если готового фото с таким file_id нет - тогда
+        фото скачивается заново
+        """
+        # Повторное подтверждение после ошибки: фото уже перенесено на место
+        if self._collected.get(user_id, {}).get(field) == (file_id, destination) and destination.exists():
+            return True
+
+        job = self._jobs.get(user_id, {}).get(field)
+        if job is None or job[0] != file_id:
+            return False
+
+        try:
+            staged_path = await asyncio.shield(job[1])
+        except Exception:
+            return False
+        finally:
+            # Файл из промежуточной папки переносится один раз
+            if job[1].done():
+                self._jobs.get(user_id, {}).pop(field, None)
+
+        try:
+            await storage_executor.run(str(destination), shutil.move, str(staged_path), str(destination))
+        except FileNotFoundError:
+            # Промежуточную папку удалили (например, /start в другом процессе бота)
+            logger.warning(f"Заранее скачанное фото {field} пользователя {user_id} пропало, скачиваем заново")
+            return False
+        self._collected.setdefault(user_id, {})[field] = (file_id, destination)
+        return True
+
+    def discard(self, user_id: int):
+        """Отменяет скачивания пользователя и удаляет его промежуточную папку"""
+        for _, task in self._jobs.pop(user_id, {}).values():
+            task.cancel()
+        self._collected.pop(user_id, None)
+
+        staging_dir = self.get_staging_dir(user_id)
+        if staging_dir.exists():
+            asyncio.create_task(
+                storage_executor.run(str(staging_dir), shutil.rmtree, staging_dir, ignore_errors=True)
+            )
+
+    def clear_all(self):
+        """Удаляет промежуточные файлы, оставшиеся от прошлого запуска"""
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    async def close(self):
+        """Отменяет все незавершенные скачивания"""
+        tasks = [task for jobs in self._jobs.values() for _, task in jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs.clear()
+        self._collected.clear()
+
+
+photo_prefetcher = PhotoPrefetcher()
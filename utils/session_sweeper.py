@@ -0,0 +1,76 @@
+"""
+Удаление брошенных регистраций
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from config.settings import FSM_SESSION_TTL, FSM_SWEEP_INTERVAL
+from utils.fsm_storage import SQLiteStorage, fsm_storage
+from utils.prefetch import PhotoPrefetcher, photo_prefetcher
+
+logger = logging.getLogger(__name__)
+
+
+class SessionSweeper:
+    """
+    Раз в interval секунд удаляет состояния FSM, не менявшиеся дольше ttl
+    секунд, вместе с фото, скачанными для них заранее. Заодно пишет в лог
+    число живых сессий и объем, который они занимают в памяти
+    """
+
+    def __init__(
+        self,
+        storage: SQLiteStorage = fsm_storage,
+        prefetcher: PhotoPrefetcher = photo_prefetcher,
+        ttl: float = FSM_SESSION_TTL,
+        interval: float = FSM_SWEEP_INTERVAL
+    ):
+        self.storage = storage
+        self.prefetcher = prefetcher
+        self.ttl = ttl
+        self.interval = interval
+        self.expired_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> int:
+        """Удаляет брошенные сессии. Возвращает их количество"""
+        user_ids = await self.storage.expire_idle(self.ttl)
+        for user_id in user_ids:
+            self.prefetcher.discard(user_id)
+        self.expired_total += len(user_ids)
+
+        stats = await self.storage.stats()
+        logger.info(
+            f"Сессии FSM: живых={stats['sessions']}, в кэше={stats['cached']} "
+            f"(~{stats['cache_bytes']} байт), со скачиваниями фото={self.prefetcher.active_users}, "
+            f"удалено брошенных={len(user_ids)} (всего {self.expired_total})"
+        )
+        return len(user_ids)
+
+    async def _run(self):
+        """Фоновый цикл очистки"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка при очистке брошенных регистраций: {e}")
+
+    def start(self):
+        """Запускает фоновую очистку"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую очистку"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+session_sweeper = SessionSweeper()
@@ -0,0 +1,103 @@
+"""
+Статистика регистраций в памяти (для команды /stats)
+"""
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from config.settings import CURATORS, STATS_TOP_POSITIONS
+from utils.storage import RegistrationStore, StoreView, store
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+class StatsService(StoreView):
+    """
+    Счетчики участников по куратору, дню и должности. При запуске
+    собираются из базы одним запросом, дальше увеличиваются при каждой
+    регистрации - /stats не читает ни базу, ни Excel файлы.
+    Записи других процессов бота дочитываются перед выдачей статистики
+    """
+
+    def __init__(self, registration_store: RegistrationStore = store):
+        super().__init__(registration_store)
+        self.total = 0
+        self.by_curator: Counter = Counter()
+        self.by_day: Counter = Counter()
+        self.by_position: Counter = Counter()
+
+    def _add(self, curator: str, day: str, position: str, count: int = 1):
+        self.total += count
+        self.by_curator[curator] += count
+        self.by_day[day] += count
+        self.by_position[position or ""] += count
+
+    def _clear(self):
+        self.total = 0
+        self.by_curator.clear()
+        self.by_day.clear()
+        self.by_position.clear()
+
+    def _apply_rows(self, after_id: int) -> int:
+        rows = self.store.count_registrations(after_id)
+        for row in rows:
+            self._add(row["curator"], row["day"], row["position"], row["count"])
+        return max([after_id] + [row["max_id"] for row in rows])
+
+    def load(self):
+        """Собирает счетчики из базы заново"""
+        super().load()
+        logger.info(f"Статистика загружена из базы: участников {self.total}")
+
+    def record(
+        self,
+        participant_id: int,
+        curator: str,
+        position: str,
+        registered_at: Optional[datetime] = None
+    ):
+        """Учитывает только что записанного участника"""
+        day = (registered_at or datetime.now()).strftime(DAY_FORMAT)
+        self._record(participant_id, lambda: self._add(curator, day, position))
+
+    def snapshot(
+        self,
+        days: int = 7,
+        today: Optional[date] = None,
+        top_positions: int = STATS_TOP_POSITIONS
+    ) -> Dict[str, Any]:
+        """
+        Итоги: всего, по кураторам, за последние days дней и по должностям.
+        Должности - top_positions самых частых, остальные в other_positions
+        (число должностей, участников)
+        """
+        today = today or date.today()
+        with self._lock:
+            by_day = [
+                (day, self.by_day.get(day.strftime(DAY_FORMAT), 0))
+                for day in (today - timedelta(days=offset) for offset in range(days))
+            ]
+            by_curator = {curator: self.by_curator.get(curator, 0) for curator in CURATORS}
+            # Участники кураторов, которых больше нет в настройках
+            by_curator.update({
+                curator: count for curator, count in self.by_curator.items()
+                if curator not in by_curator and count
+            })
+            by_position = self.by_position.most_common()
+            return {
+                "total": self.total,
+                "today": by_day[0][1],
+                "by_curator": by_curator,
+                "by_day": by_day,
+                "by_position": by_position[:top_positions],
+                "other_positions": (
+                    len(by_position[top_positions:]),
+                    sum(count for _, count in by_position[top_positions:])
+                ),
+            }
+
+
+stats_service = StatsService()
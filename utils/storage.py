@@ -0,0 +1,410 @@
+"""
+Хранилище регистраций на SQLite - единый источник данных об участниках.
+Excel файлы строятся из него (см. utils/excel_writer.py)
+"""
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from openpyxl import load_workbook
+
+from config.settings import DB_FILE
+from utils.excel_manager import get_general_excel_path
+from utils.file_manager import get_user_folder
+
+logger = logging.getLogger(__name__)
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Служебное значение: номер поколения данных
+GENERATION_KEY = "generation"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS participants (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    total_number    INTEGER NOT NULL,
+    curator_number  INTEGER NOT NULL,
+    curator         TEXT NOT NULL,
+    fio             TEXT NOT NULL,
+    pharmacy_name   TEXT NOT NULL DEFAULT '',
+    pharmacy_number TEXT NOT NULL DEFAULT '',
+    position        TEXT NOT NULL DEFAULT '',
+    inn             TEXT,
+    phone           TEXT,
+    user_id         INTEGER,
+    username        TEXT,
+    folder          TEXT,
+    registered_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_participants_curator ON participants (curator, curator_number);
+CREATE INDEX IF NOT EXISTS idx_participants_inn ON participants (inn);
+CREATE INDEX IF NOT EXISTS idx_participants_phone ON participants (phone);
+CREATE INDEX IF NOT EXISTS idx_participants_registered_at ON participants (registered_at);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Сколько ждать, пока другой процесс бота освободит базу, сек
+BUSY_TIMEOUT = 30
+
+# Счетчик общего номера в таблице counters (остальные - по имени куратора)
+TOTAL_COUNTER = "total"
+
+PARTICIPANT_FIELDS = (
+    "total_number", "curator_number", "curator", "fio",
+    "pharmacy_name", "pharmacy_number", "position",
+    "inn", "phone", "user_id", "username", "folder", "registered_at"
+)
+
+# Заголовки старых Excel файлов -> поля таблицы participants
+LEGACY_EXCEL_HEADERS = {
+    "Общий №": "total_number",
+    "№ у куратора": "curator_number",
+    "ФИО": "fio",
+    "Аптека": "pharmacy_name",
+    "Номер аптеки": "pharmacy_number",
+    "Должность": "position",
+    "ИНН": "inn",
+    "Телефон": "phone",
+    "Куратор": "curator",
+    "Дата регистрации": "registered_at",
+}
+
+
+class RegistrationStore:
+    """
+    Таблица участников в SQLite (режим WAL) с индексами по куратору,
+    ИНН, телефону и дате регистрации. Соединение общее для всех потоков,
+    обращения к нему сериализуются блокировкой.
+
+    База может быть общей для нескольких процессов бота: номера участников
+    выдаются в той же транзакции, что и запись участника (см. register_participant).
+    """
+
+    def __init__(self, db_path: str = DB_FILE):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Открывает соединение при первом обращении"""
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        """Закрывает соединение"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _insert_participant(self, values: Dict[str, Any]) -> int:
+        """Вставляет запись внутри уже открытой транзакции"""
+        for field in ("pharmacy_name", "pharmacy_number", "position"):
+            values[field] = values[field] or ""
+
+        columns = ", ".join(PARTICIPANT_FIELDS)
+        placeholders = ", ".join(f":{field}" for field in PARTICIPANT_FIELDS)
+        cursor = self.conn.execute(
+            f"INSERT INTO participants ({columns}) VALUES ({placeholders})",
+            values
+        )
+        # Номер поколения данных меняется с каждой новой записью
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (GENERATION_KEY,)
+        )
+        return cursor.lastrowid
+
+    def _increment_counter(self, name: str) -> int:
+        """Увеличивает счетчик внутри уже открытой транзакции"""
+        # Без RETURNING: он появился только в SQLite 3.35, а в Ubuntu 20.04
+        # и Debian 11 стоят 3.31 и 3.34. Транзакция уже держит запись -
+        # между UPDATE и SELECT значение никто не изменит
+        self.conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+        return self.conn.execute(
+            "SELECT value FROM counters WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    def add_participant(self, record: Dict[str, Any]) -> int:
+        """
+        Добавляет участника с уже известными номерами одной транзакцией.
+        Возвращает id записи
+        """
+        values = {field: record.get(field) for field in PARTICIPANT_FIELDS}
+        if not values["registered_at"]:
+            values["registered_at"] = datetime.now().strftime(DATETIME_FORMAT)
+
+        with self._lock, self.conn:
+            return self._insert_participant(values)
+
+    def register_participant(self, record: Dict[str, Any]) -> Tuple[int, int, int]:
+        """
+        Выдает участнику следующие номера и записывает его одной транзакцией.
+        BEGIN IMMEDIATE сразу берет блокировку записи, поэтому процессы бота
+        выдают номера строго по очереди. Если запись не удалась, счетчики
+        откатываются вместе с ней - номера идут без пропусков.
+        Возвращает: (id записи, общий номер, номер куратора)
+        """
+        values = {field: record.get(field) for field in PARTICIPANT_FIELDS}
+        values["registered_at"] = values["registered_at"] or datetime.now().strftime(DATETIME_FORMAT)
+
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                values["total_number"] = self._increment_counter(TOTAL_COUNTER)
+                values["curator_number"] = self._increment_counter(values["curator"])
+                participant_id = self._insert_participant(values)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return participant_id, values["total_number"], values["curator_number"]
+
+    def get_counters(self) -> Dict[str, int]:
+        """Текущие значения счетчиков"""
+        with self._lock:
+            rows = self.conn.execute("SELECT name, value FROM counters").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def seed_counters(self, counters: Dict[str, int]):
+        """
+        Поднимает счетчики до значений из старого counters.json и до
+        максимальных номеров в таблице участников (уменьшить их нельзя)
+        """
+        with self._lock, self.conn:
+            seeds = dict(counters)
+            row = self.conn.execute("SELECT MAX(total_number) FROM participants").fetchone()
+            seeds[TOTAL_COUNTER] = max(seeds.get(TOTAL_COUNTER, 0), row[0] or 0)
+            for curator, number in self.conn.execute(
+                "SELECT curator, MAX(curator_number) FROM participants GROUP BY curator"
+            ).fetchall():
+                seeds[curator] = max(seeds.get(curator, 0), number or 0)
+
+            for name, value in seeds.items():
+                self.conn.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+                    (name, int(value))
+                )
+
+    def get_participants_since(
+        self,
+        last_id: int = 0,
+        curator: Optional[str] = None,
+        up_to: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Возвращает участников с id больше last_id (по порядку добавления).
+        up_to - только до этого id включительно
+        """
+        query = "SELECT * FROM participants WHERE id > ?"
+        params: list = [last_id]
+        if up_to is not None:
+            query += " AND id <= ?"
+            params.append(up_to)
+        if curator is not None:
+            query += " AND curator = ?"
+            params.append(curator)
+        query += " ORDER BY id"
+
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_participants_registered_since(self, since: datetime) -> List[Dict[str, Any]]:
+        """Возвращает участников, зарегистрированных начиная с since"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM participants WHERE registered_at >= ? ORDER BY id",
+                (since.strftime(DATETIME_FORMAT),)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_participants(self) -> int:
+        """Количество участников в базе"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0]
+
+    def count_registrations(self, after_id: int = 0) -> List[Dict[str, Any]]:
+        """
+        Число участников с id больше after_id по куратору, дню регистрации
+        и должности. В max_id - id последней учтенной записи группы
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT curator, substr(registered_at, 1, 10) AS day, position, "
+                "COUNT(*) AS count, MAX(id) AS max_id "
+                "FROM participants WHERE id > ? GROUP BY curator, day, position",
+                (after_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_identities(self, after_id: int = 0) -> List[Dict[str, Any]]:
+        """ИНН и телефоны участников с id больше after_id (для поиска дублей)"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, total_number, curator, fio, inn, phone FROM participants "
+                "WHERE id > ? ORDER BY id",
+                (after_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_last_id(self) -> int:
+        """id последней записи (0, если база пустая)"""
+        with self._lock:
+            row = self.conn.execute("SELECT MAX(id) FROM participants").fetchone()
+        return row[0] or 0
+
+    def get_generation(self) -> int:
+        """Номер поколения данных: растет при каждой новой регистрации"""
+        return int(self.get_meta(GENERATION_KEY, "0"))
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Читает служебное значение"""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: Any):
+        """Сохраняет служебное значение"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
+
+    def import_legacy_excel(self) -> int:
+        """
+        Переносит в пустую базу участников из общего Excel файла,
+        заполненного до появления базы. Возвращает число перенесенных записей
+        """
+        excel_path = get_general_excel_path()
+        if not excel_path.exists() or self.count_participants() > 0:
+            return 0
+
+        wb = load_workbook(excel_path, read_only=True)
+        rows = wb.active.iter_rows(values_only=True)
+        headers = [LEGACY_EXCEL_HEADERS.get(h) for h in next(rows, [])]
+
+        imported = 0
+        for row in rows:
+            record = {field: value for field, value in zip(headers, row) if field}
+            if not record.get("fio") or not record.get("total_number"):
+                continue
+
+            if record.get("registered_at"):
+                try:
+                    registered_at = datetime.strptime(str(record["registered_at"]), "%d.%m.%Y %H:%M")
+                    record["registered_at"] = registered_at.strftime(DATETIME_FORMAT)
+                except ValueError:
+                    record["registered_at"] = None
+
+            for field in ("inn", "phone", "pharmacy_number"):
+                if record.get(field) is not None:
+                    record[field] = str(record[field])
+
+            record.setdefault("curator_number", 0)
+            record.setdefault("curator", "")
+            record["folder"] = str(get_user_folder(record["curator"], str(record["fio"])))
+            self.add_participant(record)
+            imported += 1
+
+        wb.close()
+        logger.info(f"Из {excel_path} перенесено участников: {imported}")
+        return imported
+
+
+def parse_registered_at(value: str) -> datetime:
+    """Преобразует дату регистрации из базы в datetime"""
+    return datetime.strptime(value, DATETIME_FORMAT)
+
+
+class StoreView(ABC):
+    """
+    Данные в памяти, собранные из таблицы участников. При запуске строятся
+    из базы (load), дальше пополняются при каждой регистрации (_record).
+
+    Записи других процессов бота дочитываются из базы по id после
+    последнего учтенного (catch_up). Если запись пришла не по порядку id,
+    _record ее пропускает и отмечает behind - она тоже будет дочитана
+    """
+
+    def __init__(self, registration_store: "RegistrationStore"):
+        self.store = registration_store
+        self._last_id = 0
+        self._behind = False
+        self._lock = threading.Lock()
+
+    @property
+    def behind(self) -> bool:
+        """В базе есть записи, которые еще не учтены"""
+        return self._behind
+
+    @abstractmethod
+    def _clear(self):
+        """Очищает данные перед загрузкой. Вызывается под блокировкой"""
+
+    @abstractmethod
+    def _apply_rows(self, after_id: int) -> int:
+        """
+        Добавляет записи базы с id больше after_id и возвращает id последней
+        из них (after_id, если новых нет). Вызывается под блокировкой
+        """
+
+    def load(self):
+        """Собирает данные из базы заново"""
+        with self._lock:
+            self._clear()
+            self._last_id = 0
+            self._catch_up()
+
+    def _catch_up(self):
+        self._last_id = self._apply_rows(self._last_id)
+        self._behind = False
+
+    def catch_up(self):
+        """Дочитывает записи, сделанные другими процессами"""
+        # Блокировка на время запроса: _record не учтет запись, которую читаем из базы
+        with self._lock:
+            self._catch_up()
+
+    def _record(self, participant_id: int, add: Callable[[], None]):
+        """Учитывает только что записанного участника: add() вызывается под блокировкой"""
+        with self._lock:
+            if participant_id != self._last_id + 1:
+                # Между ними записи других процессов - их (и эту) дочитает catch_up
+                self._behind = True
+                return
+            add()
+            self._last_id = participant_id
+
+
+store = RegistrationStore()
@@ -0,0 +1,99 @@
+"""
+Трассировка завершения регистрации по этапам
+"""
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+
+from config.settings import SLOW_REGISTRATION_THRESHOLD, SLOW_REGISTRATION_KEEP
+from utils.metrics import REGISTRATION_STAGE
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationTrace:
+    """
+    Этапы (spans) одной регистрации: имя, длительность, ошибка.
+    В каждой записи лога есть id пользователя и, когда он уже известен, общий номер
+    """
+
+    def __init__(self, user_id: Optional[int], curator: Optional[str]):
+        self.user_id = user_id
+        self.curator = curator
+        self.total_number: Optional[int] = None
+        self.started_at = datetime.now()
+        self.duration = 0.0
+        self.ok = False
+        self.spans: List[Tuple[str, float, Optional[str]]] = []
+        self._started = time.perf_counter()
+
+    @property
+    def label(self) -> str:
+        """Кто регистрируется - для строк лога"""
+        number = f", №{self.total_number}" if self.total_number is not None else ""
+        return f"user_id={self.user_id}{number}"
+
+    @contextmanager
+    def span(self, name: str):
+        """Замеряет этап; ошибка этапа попадает в лог и пробрасывается дальше"""
+        started_at = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"Регистрация {self.label}: ошибка на этапе {name}: {error}")
+            raise
+        finally:
+            duration = time.perf_counter() - started_at
+            self.spans.append((name, duration, error))
+            REGISTRATION_STAGE.observe(duration, stage=name)
+
+    def breakdown(self) -> str:
+        """Этапы с длительностями одной строкой"""
+        return ", ".join(
+            f"{name}={duration * 1000:.0f}мс" + (" (ошибка)" if error else "")
+            for name, duration, error in self.spans
+        )
+
+
+class RegistrationTracer:
+    """
+    Хранит последние keep завершенных регистраций. Регистрации дольше
+    threshold секунд пишутся в лог с разбивкой по этапам
+    """
+
+    def __init__(
+        self,
+        threshold: float = SLOW_REGISTRATION_THRESHOLD,
+        keep: int = SLOW_REGISTRATION_KEEP
+    ):
+        self.threshold = threshold
+        self._recent: Deque[RegistrationTrace] = deque(maxlen=keep)
+
+    def start(self, user_id: Optional[int], curator: Optional[str]) -> RegistrationTrace:
+        """Начинает трассировку регистрации"""
+        return RegistrationTrace(user_id, curator)
+
+    def finish(self, trace: RegistrationTrace, ok: bool):
+        """Завершает трассировку: запоминает ее и пишет в лог, если она медленная"""
+        trace.duration = time.perf_counter() - trace._started
+        trace.ok = ok
+        REGISTRATION_STAGE.observe(trace.duration, stage="total")
+        self._recent.append(trace)
+
+        if trace.duration >= self.threshold:
+            logger.warning(
+                f"Медленная регистрация {trace.label}: {trace.duration:.2f} с "
+                f"({'успешно' if ok else 'с ошибкой'}). Этапы: {trace.breakdown()}"
+            )
+
+    def slowest(self, limit: int = 10) -> List[RegistrationTrace]:
+        """Самые долгие из последних регистраций"""
+        return sorted(self._recent, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+
+registration_tracer = RegistrationTracer()
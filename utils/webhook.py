@@ -0,0 +1,180 @@
+"""
+Работа бота через webhook: встроенный aiohttp сервер
+"""
+import asyncio
+import logging
+import secrets
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config.settings import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_MAX_CONCURRENT,
+    WEBHOOK_MAX_PENDING,
+    HEALTH_PATH,
+    OUTBOUND_DRAIN_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Принимает апдейты от Telegram и сразу отвечает 200, а обработку
+    запускает в фоне. Одновременно обрабатывается не больше max_concurrent
+    апдейтов, остальные ждут. Если ждущих больше max_pending, отвечаем 503:
+    Telegram сохранит апдейт у себя и повторит доставку позже
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: Optional[str] = None,
+        max_concurrent: int = WEBHOOK_MAX_CONCURRENT,
+        max_pending: int = WEBHOOK_MAX_PENDING,
+        **data: Any
+    ):
+        super().__init__(
+            dispatcher=dispatcher, bot=bot, handle_in_background=True,
+            secret_token=secret_token, **data
+        )
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.pending = 0
+        self.running = 0
+        self.handled = 0
+        self.rejected = 0
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        started = False
+        try:
+            async with self._slots:
+                self.pending -= 1
+                self.running += 1
+                started = True
+                await super()._background_feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+        finally:
+            if started:
+                self.running -= 1
+                self.handled += 1
+            else:
+                self.pending -= 1
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Очередь апдейтов переполнена ({self.pending}), Telegram повторит доставку")
+            return web.Response(status=503, text="Overloaded")
+        self.pending += 1
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            # Тело запроса не разобралось - апдейт в очередь не попал
+            self.pending -= 1
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        """Состояние очереди апдейтов"""
+        return {
+            "pending": self.pending,
+            "running": self.running,
+            "handled": self.handled,
+            "rejected": self.rejected,
+        }
+
+    async def close(self) -> None:
+        """Дожидается обработки принятых апдейтов (сессию бота закрывает main)"""
+        tasks = list(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info(f"Дожидаемся обработки апдейтов: {len(tasks)}")
+        _, unfinished = await asyncio.wait(tasks, timeout=OUTBOUND_DRAIN_TIMEOUT)
+        for task in unfinished:
+            task.cancel()
+
+
+WEBHOOK_HANDLER_KEY = web.AppKey("webhook_handler", BoundedRequestHandler)
+
+
+def build_webhook_app(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    secret_token: Optional[str] = None,
+    health_stats: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+    max_concurrent: int = WEBHOOK_MAX_CONCURRENT,
+    max_pending: int = WEBHOOK_MAX_PENDING,
+    **data: Any
+) -> web.Application:
+    """
+    Приложение aiohttp с обработчиком апдейтов и проверкой здоровья.
+    health_stats - дополнительные счетчики для ответа /health (имя -> функция)
+    """
+    app = web.Application()
+    handler = BoundedRequestHandler(
+        dispatcher, bot, secret_token=secret_token,
+        max_concurrent=max_concurrent, max_pending=max_pending, **data
+    )
+    handler.register(app, path=WEBHOOK_PATH)
+    app[WEBHOOK_HANDLER_KEY] = handler
+
+    async def health(request: web.Request) -> web.Response:
+        extra = {name: get_stats() for name, get_stats in (health_stats or {}).items()}
+        return web.json_response({"status": "ok", **handler.stats(), **extra})
+
+    app.router.add_get(HEALTH_PATH, health)
+    setup_application(app, dispatcher, bot=bot, **data)
+    return app
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    secret_token: Optional[str] = None,
+    register: bool = True,
+    reuse_port: bool = False,
+    health_stats: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+    **data: Any
+):
+    """
+    Обслуживает входящие запросы, пока задачу не отменят.
+    register - зарегистрировать webhook в Telegram при запуске (при
+    нескольких процессах это делает один из них), reuse_port - слушать
+    порт вместе с другими процессами бота
+    """
+    secret_token = secret_token or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = build_webhook_app(
+        dispatcher, bot, secret_token=secret_token, health_stats=health_stats, **data
+    )
+
+    async def on_startup(*args: Any, **kwargs: Any):
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONCURRENT
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    if register:
+        dispatcher.startup.register(on_startup)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=reuse_port or None)
+    await site.start()
+    logger.info(f"Сервер webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Останавливает прием запросов и дожидается обработки принятых апдейтов
+        await runner.cleanup()